@@ -0,0 +1,289 @@
+# benchmark.py
+"""
+Headless benchmark of the ingestion-to-chart pipeline.
+
+Runs each stage (CSV ingestion into the engine's partitions and snapshots, snapshot reload,
+combining the partitions, categorization, geography index, sidebar filtering, aggregation,
+NIC drill-down and the ML fits) outside Streamlit, on a real data folder or on synthetic NIC
+census CSVs, and prints latency percentiles, throughput and peak traced memory per stage as JSON.
+
+Usage:
+	python benchmark.py --states 36 --districts 20 --years 2 --output bench.json
+	python benchmark.py --data-dir <data_dir> --compare-categorize
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import engine
+import ml
+import utils
+from engine import COL_BUSINESS_CATEGORY, COL_NIC_CODE, COL_NIC_NAME, COL_STATE_CODE, COL_STATE_NAME
+
+WORKER_COLUMNS = engine.worker_columns
+ML_FEATURES = WORKER_COLUMNS[:3] + WORKER_COLUMNS[9:12]
+
+# --- Synthetic data ---
+def generate_census_csvs(out_dir, states=1, districts=10, years=1, seed=0):
+	"""
+	Writes one NIC census CSV per state and year into out_dir, in the layout of the DDW_B18 exports:
+	a state row block followed by one block per district, each starting with the 'Total' row.
+	Returns the written file paths.
+	"""
+	rng = np.random.default_rng(seed)
+	nic_names = sorted({name for names in utils.categories.values() for name in names})
+	header = ['Table Name', 'State Code ', 'District Code', 'India/States', 'Division', 'Group', 'Class', 'NIC Name'] + WORKER_COLUMNS
+	paths = []
+	for year in range(years):
+		for state in range(1, states + 1):
+			geos = [(0, f'STATE - SYNTHETIC STATE {state:02d}')]
+			geos += [(d, f'District - Synthetic District {state:02d}-{d:03d}') for d in range(1, districts + 1)]
+			rows = []
+			for district_code, geo_name in geos:
+				counts = rng.integers(0, 5000, size=(len(nic_names), len(WORKER_COLUMNS)))
+				rows.append(['B1812', f'`{state:02d}', f'`{district_code:03d}', geo_name, '`00', '`000', '`0000', 'Total'] + counts.sum(axis=0).tolist())
+				for i, (name, row_counts) in enumerate(zip(nic_names, counts)):
+					division = i % 99 + 1
+					rows.append(['B1812', f'`{state:02d}', f'`{district_code:03d}', geo_name,
+						f'`{division:02d}', f'`{division:02d}{i % 10}', f'`{division:02d}{i % 10}{i % 7}', name] + row_counts.tolist())
+			path = os.path.join(out_dir, f'DDW_B18_SYNTHETIC_STATE_{state:02d}-{2011 + year * 10}.csv')
+			pd.DataFrame(rows, columns=header).to_csv(path, index=False, encoding='utf-8')
+			paths.append(path)
+	return paths
+
+# --- Stages ---
+def _clear_caches(ctx, snapshots=True):
+	"""Forgets everything the engine cached in memory and, if snapshots, its snapshots on disk."""
+	utils._fingerprint_cache.clear()
+	utils._detected_encodings.clear()
+	if snapshots:
+		shutil.rmtree(ctx['census'].snapshot_dir, ignore_errors=True)
+
+def stage_ingest(ctx):
+	"""Cold start as in the dashboard: every CSV read, cleaned and categorized into its partition, then snapshotted."""
+	_clear_caches(ctx)
+	return sum(len(part) for part in ctx['census'].partitions().values())
+
+def stage_snapshot_load(ctx):
+	"""Restart with current snapshots: every partition memory-mapped from its snapshot."""
+	_clear_caches(ctx, snapshots=False)
+	return sum(len(part) for part in ctx['census'].partitions().values())
+
+def stage_combine(ctx):
+	"""CensusEngine.load(): the cached partitions concatenated into the cleaned frame."""
+	utils._fingerprint_cache.pop(('base', ctx['census'].data_dir), None)
+	ctx['base'] = ctx['census'].load()
+	return len(ctx['base'])
+
+def stage_stream(ctx):
+	"""Streaming mode: chunked read, clean and categorize of every file, combined into the cleaned frame."""
+	census = engine.CensusEngine(os.path.dirname(ctx['paths'][0]), streaming=True)
+	base = utils.concat_categorical(list(census.stream()))
+	return len(base)
+
+def stage_categorize(ctx):
+	utils.categorize_activities(ctx['nic_names'])
+	return len(ctx['nic_names'])
+
+def stage_categorize_per_row(ctx):
+	"""Reference per-row categorizer; also counts the names where it disagrees with the vectorized one."""
+	per_row = ctx['nic_names'].apply(utils.categorize_activity)
+	ctx['categorize_mismatches'] = int((per_row != utils.categorize_activities(ctx['nic_names'])).sum())
+	return len(ctx['nic_names'])
+
+def stage_geo_index(ctx):
+	ctx['geo_index'] = utils.build_geo_index(ctx['base'], COL_STATE_CODE, COL_STATE_NAME)
+	return len(ctx['base'])
+
+def stage_filter(ctx):
+	"""Sidebar filtering for a fixed random half of the states, all their districts and categories."""
+	base, geo_index = ctx['base'], ctx['geo_index']
+	states = ctx['selected_states']
+	codes, districts = engine.select_states(geo_index, states)
+	categories = engine.select_categories(base, geo_index, codes, districts)
+	ctx['filtered'] = engine.select_rows(base, ctx['cube'], geo_index, codes, states, districts, categories)['rows']
+	return len(base)
+
+def stage_filter_sql(ctx):
+	"""stage_filter answered by the embedded SQL backend, including the pushed-down cube slices."""
+	queries = ctx['sql_queries']
+	states = ctx['selected_states']
+	codes, districts = queries.select_states(states)
+	categories = queries.select_categories(codes, districts)
+	ctx['filtered_sql'] = queries.select_rows(codes, states, districts, categories)['rows']
+	return len(ctx['base'])
+
+def stage_aggregate(ctx):
+	"""Cube build plus the state, district and category roll-ups behind the charts."""
+	base = ctx['base']
+	ctx['cube'] = cube = engine.build_worker_cube(base)
+	engine.aggregate(cube, COL_STATE_NAME, WORKER_COLUMNS[:2])
+	engine.aggregate(cube, COL_BUSINESS_CATEGORY, WORKER_COLUMNS[:2])
+	engine.totals(cube)
+	return len(base)
+
+def stage_nic_drilldown(ctx):
+	"""NIC hierarchy index of the filtered rows, then every division, group and class roll-up by range lookups."""
+	rows = ctx['filtered']
+	index = engine.nic_index(rows[[COL_NIC_CODE, COL_NIC_NAME]])
+	sorted_positions = utils.nic_sorted_positions(rows[COL_NIC_CODE])
+	engine.nic_drilldown(rows, sorted_positions, index, 'Division', measures=WORKER_COLUMNS[:2])
+	for division, groups in index['divisions'].items():
+		engine.nic_drilldown(rows, sorted_positions, index, 'Group', division, measures=WORKER_COLUMNS[:2])
+		for group in groups:
+			engine.nic_drilldown(rows, sorted_positions, index, 'Class', group, measures=WORKER_COLUMNS[:2])
+	return len(rows)
+
+def stage_random_forest(ctx):
+	ml._memory_cache.clear()
+	df = ctx['filtered'].head(ctx['ml_rows'])
+	ml.fit_random_forest(df[ML_FEATURES], df[COL_BUSINESS_CATEGORY], n_estimators=100, n_jobs=-1, random_state=42)
+	return len(df)
+
+def stage_kmeans(ctx):
+	ml._memory_cache.clear()
+	group_df = ctx['filtered'].groupby(COL_STATE_NAME, observed=True)[ML_FEATURES].sum()
+	ml.kmeans_sweep(group_df, range(2, 9), random_state=42, n_init=10)
+	return len(group_df)
+
+# --- Import cost ---
+# Modules the dashboard imports; plotly only with the Visualizations tab, scikit-learn only with the ML tab
+IMPORT_GROUPS = {
+	'engine': ['engine'],
+	'plotly': ['plotly.express'],
+	'sklearn': ['sklearn.model_selection', 'sklearn.metrics', 'sklearn.ensemble', 'sklearn.cluster'],
+}
+
+def import_cost(modules, repeat=3):
+	"""Best-of-repeat wall time (ms) of importing modules in a fresh interpreter, i.e. the cold-start cost."""
+	code = f"import time; t = time.perf_counter(); import {', '.join(modules)}; print(time.perf_counter() - t)"
+	here = os.path.dirname(os.path.abspath(__file__))
+	timings = []
+	for _ in range(repeat):
+		out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=here)
+		timings.append(float(out.stdout.split()[-1]) * 1000)
+	return round(min(timings), 1)
+
+# --- Measurement ---
+def measure(name, func, ctx, repeat):
+	"""
+	Runs func(ctx) repeat times for timing, then once more under tracemalloc for peak memory.
+	Returns a dict with latency percentiles (ms), throughput (rows/s at the median) and peak MB.
+	"""
+	latencies = []
+	rows = 0
+	for _ in range(repeat):
+		start = time.perf_counter()
+		rows = func(ctx)
+		latencies.append((time.perf_counter() - start) * 1000)
+	tracemalloc.start()
+	func(ctx)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+	return {
+		'stage': name,
+		'rows': int(rows),
+		'repeat': repeat,
+		'latency_ms': {
+			'min': round(min(latencies), 3), 'p50': round(p50, 3), 'p90': round(p90, 3),
+			'p99': round(p99, 3), 'max': round(max(latencies), 3),
+		},
+		'rows_per_s': round(rows / (p50 / 1000), 1) if p50 > 0 else None,
+		'peak_traced_mb': round(peak / 1024 ** 2, 3),
+	}
+
+def run_benchmark(paths, repeat=5, workers=1, skip_ml=False, compare_categorize=False, ml_rows=20000, seed=0, imports=False,
+		streaming=False, sql=False):
+	"""Runs every stage in pipeline order on the CSV files in paths and returns the JSON-ready report."""
+	# Snapshots go to a temporary folder so benchmarking a data folder leaves it untouched
+	snapshot_dir = tempfile.mkdtemp(prefix='census_snapshot_')
+	census = engine.CensusEngine(os.path.dirname(paths[0]), snapshot_dir=snapshot_dir, workers=workers)
+	ctx = {'paths': paths, 'workers': workers, 'ml_rows': ml_rows, 'census': census}
+	stages = [('ingest', stage_ingest), ('snapshot_load', stage_snapshot_load), ('combine', stage_combine)]
+	if streaming:
+		stages.append(('ingest_streaming', stage_stream))
+	stages.append(('categorize', stage_categorize))
+	if compare_categorize:
+		stages.append(('categorize_per_row', stage_categorize_per_row))
+	stages += [('geo_index', stage_geo_index), ('aggregate', stage_aggregate), ('filter', stage_filter), ('nic_drilldown', stage_nic_drilldown)]
+	if sql:
+		stages.append(('filter_sql', stage_filter_sql))
+	if not skip_ml:
+		stages += [('random_forest', stage_random_forest), ('kmeans_sweep', stage_kmeans)]
+	results = []
+	try:
+		for name, func in stages:
+			if name == 'categorize':
+				# Raw NIC names of every file, read outside the timed stages
+				frames = [df.rename(columns=str.strip) for df, warning in utils.load_csv_files(paths) if df is not None]
+				ctx['nic_names'] = pd.concat([df[COL_NIC_NAME] for df in frames], ignore_index=True).astype(str).str.strip()
+			if name == 'filter':
+				states = utils.build_geo_index(ctx['base'], COL_STATE_CODE, COL_STATE_NAME)['states']
+				ctx['selected_states'] = random.Random(seed).sample(states, max(1, len(states) // 2))
+			if name == 'filter_sql':
+				ctx['sql_queries'] = census.queries(backend='sql')
+			results.append(measure(name, func, ctx, repeat))
+	finally:
+		shutil.rmtree(snapshot_dir, ignore_errors=True)
+	return {
+		'environment': {
+			'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+			'cpu_count': os.cpu_count(), 'platform': platform.platform(),
+		},
+		'files': len(paths),
+		'bytes': sum(os.path.getsize(path) for path in paths),
+		'stages': results,
+		'categorize_mismatches': ctx.get('categorize_mismatches'),
+		'import_ms': {name: import_cost(modules) for name, modules in IMPORT_GROUPS.items()} if imports else None,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Headless benchmark of the ingestion-to-chart pipeline.')
+	parser.add_argument('--data-dir', help='Benchmark the CSVs in this folder instead of synthetic data')
+	parser.add_argument('--states', type=int, default=1, help='Synthetic states per year')
+	parser.add_argument('--districts', type=int, default=10, help='Synthetic districts per state')
+	parser.add_argument('--years', type=int, default=1, help='Synthetic census years')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=5, help='Timed runs per stage')
+	parser.add_argument('--workers', type=int, default=1, help='Ingestion worker threads')
+	parser.add_argument('--skip-ml', action='store_true', help='Skip the Random Forest and KMeans stages')
+	parser.add_argument('--compare-categorize', action='store_true', help='Also time the per-row categorize_activity')
+	parser.add_argument('--imports', action='store_true', help='Also time cold imports of the engine, plotly and scikit-learn')
+	parser.add_argument('--streaming', action='store_true', help='Also time chunked streaming ingestion (read + clean)')
+	parser.add_argument('--sql', action='store_true', help='Also time sidebar filtering on the embedded SQL backend')
+	parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+	args = parser.parse_args()
+
+	options = dict(repeat=args.repeat, workers=args.workers, skip_ml=args.skip_ml,
+		compare_categorize=args.compare_categorize, seed=args.seed, imports=args.imports,
+		streaming=args.streaming, sql=args.sql)
+	if args.data_dir:
+		paths = sorted(os.path.join(args.data_dir, f) for f in os.listdir(args.data_dir) if f.endswith('.csv'))
+		report = run_benchmark(paths, **options)
+		report['source'] = {'data_dir': args.data_dir}
+	else:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			paths = generate_census_csvs(tmp_dir, args.states, args.districts, args.years, args.seed)
+			report = run_benchmark(paths, **options)
+		report['source'] = {'synthetic': {'states': args.states, 'districts': args.districts, 'years': args.years, 'seed': args.seed}}
+	output = json.dumps(report, indent=2)
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			f.write(output + '\n')
+	else:
+		print(output)
+	if report['categorize_mismatches']:
+		print(f"categorize_activities disagrees with categorize_activity on {report['categorize_mismatches']} names", file=sys.stderr)
+		sys.exit(1)
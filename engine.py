@@ -0,0 +1,464 @@
+# engine.py
+"""
+Headless data engine behind the dashboard.
+
+CensusEngine loads, cleans, aggregates and indexes the NIC census CSVs of one data folder, caching
+each result per data version (the fingerprint of the CSV files). The select_* and aggregate
+functions are pure: they take the engine's outputs and a sidebar selection and return new frames,
+so the same pipeline can be cached, benchmarked or served without Streamlit.
+"""
+import functools
+import os
+import time
+
+import pandas as pd
+
+try:
+	from . import utils
+except ImportError:  # imported as a top-level module, e.g. by benchmark.py
+	import utils
+
+# Column name constants
+COL_STATE_CODE = 'State Code'
+COL_NIC_NAME = 'NIC Name'
+COL_BUSINESS_CATEGORY = 'Business Category'
+COL_DISTRICT_CODE = 'District Code'
+COL_STATE_NAME = 'India/States'
+COL_GEO_LEVEL = 'Geo Level'
+# Integer NIC class code parsed from Division/Group/Class by the cleaning step (utils.NIC_LEVELS)
+COL_NIC_CODE = 'NIC Code'
+COL_MAIN_WORKERS = 'Main Workers - Total -  Persons'
+# --- Added constants for repeated worker columns ---
+COL_MAIN_WORKERS_TOTAL_MALES = 'Main Workers - Total - Males'
+COL_MAIN_WORKERS_TOTAL_FEMALES = 'Main Workers - Total - Females'
+COL_MARGINAL_WORKERS_TOTAL_PERSONS = 'Marginal Workers - Total -  Persons'
+COL_MARGINAL_WORKERS_TOTAL_MALES = 'Marginal Workers - Total - Males'
+COL_MARGINAL_WORKERS_TOTAL_FEMALES = 'Marginal Workers - Total - Females'
+
+worker_columns = [
+        'Main Workers - Total -  Persons', COL_MAIN_WORKERS_TOTAL_MALES, COL_MAIN_WORKERS_TOTAL_FEMALES,
+        'Main Workers - Rural -  Persons', 'Main Workers - Rural -  Males', 'Main Workers - Rural -  Females',
+        'Main Workers - Urban -  Persons', 'Main Workers - Urban -  Males', 'Main Workers - Urban -  Females',
+        COL_MARGINAL_WORKERS_TOTAL_PERSONS, COL_MARGINAL_WORKERS_TOTAL_MALES, COL_MARGINAL_WORKERS_TOTAL_FEMALES,
+        'Marginal Workers - Rural -  Persons', 'Marginal Workers - Rural -  Males', 'Marginal Workers - Rural -  Females',
+        'Marginal Workers - Urban -  Persons', 'Marginal Workers - Urban -  Males', 'Marginal Workers - Urban -  Females'
+]
+# Text dimensions stored as categoricals so filters and groupbys work on integer codes
+category_columns = [COL_STATE_CODE, COL_DISTRICT_CODE, COL_STATE_NAME, 'Division', 'Group', 'Class', COL_NIC_NAME, COL_BUSINESS_CATEGORY]
+
+# Dimensions of the pre-aggregated worker cube
+CUBE_DIMS = [COL_GEO_LEVEL, COL_STATE_CODE, COL_STATE_NAME, COL_BUSINESS_CATEGORY]
+
+# Data folder used when none is given; override with the IHRGV_DATA_DIR environment variable
+DEFAULT_DATA_DIR = os.environ.get('IHRGV_DATA_DIR', "C:\\WA\\POC\\Python\\IHRGV\\data")
+# Per-file Feather snapshots of the cleaned rows, inside the data folder
+SNAPSHOT_DIR = 'census_snapshot'
+# Ingestion pool: number of files parsed concurrently, and whether to use processes instead of threads
+INGEST_WORKERS = min(8, os.cpu_count() or 1)
+INGEST_USE_PROCESSES = False
+# Streaming mode cleans each CSV chunk by chunk instead of merging whole files first; for data larger than RAM
+INGEST_STREAMING = os.environ.get('IHRGV_STREAMING', '') == '1'
+# Where sidebar selections and aggregates run: 'pandas' (in memory), or 'sql' for the embedded
+# database of sqlstore.py (DuckDB when installed, else SQLite). Override with IHRGV_BACKEND.
+QUERY_BACKEND = os.environ.get('IHRGV_BACKEND', 'pandas')
+
+class CensusEngine:
+	"""
+	Data source for one folder of NIC census CSVs.
+	Every method takes an optional data version (see version()) so one rerun can fingerprint the folder once.
+	"""
+	def __init__(self, data_dir=None, snapshot_dir=SNAPSHOT_DIR, workers=INGEST_WORKERS,
+			use_processes=INGEST_USE_PROCESSES, streaming=INGEST_STREAMING, chunk_rows=utils.CSV_CHUNK_ROWS, warn=None):
+		self.data_dir = data_dir or DEFAULT_DATA_DIR
+		self.snapshot_dir = os.path.join(self.data_dir, snapshot_dir)
+		self.workers = workers
+		self.use_processes = use_processes
+		self.streaming = streaming
+		self.chunk_rows = chunk_rows
+		self.warn = warn or (lambda message: None)
+
+	@property
+	def model_cache_dir(self):
+		"""Folder where fitted models are saved, keyed on their training data and hyperparameters."""
+		return os.path.join(self.data_dir, 'model_cache')
+
+	def version(self):
+		"""Fingerprint of the CSV files; changes whenever one is added, removed or modified."""
+		return utils.dir_fingerprint(self.data_dir)
+
+	def csv_paths(self):
+		"""CSV files of the data folder, sorted by name."""
+		csv_files = sorted(f for f in os.listdir(self.data_dir) if f.endswith('.csv'))
+		return [os.path.join(self.data_dir, file) for file in csv_files]
+
+	def stream(self):
+		"""
+		Yields cleaned, categorized chunks of every CSV in file-name order, chunk_rows raw rows at a time.
+		Raw rows are dropped once their chunk is cleaned, and nothing is cached.
+		"""
+		for file_path in self.csv_paths():
+			for chunk, warning in utils.iter_csv_chunks(file_path, self.chunk_rows):
+				if warning:
+					self.warn(warning)
+					continue
+				yield utils.clean_census_data(chunk, category_columns, worker_columns)
+
+	def stream_cube(self):
+		"""The worker cube aggregated straight from stream(), without building the cleaned frame."""
+		return build_worker_cube_streaming(self.stream())
+
+	def partitions(self, version=None):
+		"""
+		{csv path: cleaned rows} of every readable CSV, in file-name order.
+		Each file is its own partition, cached per file fingerprint in memory and as a snapshot on disk,
+		so adding, replacing or removing one file only rebuilds that file. Rebuilds run in parallel when workers > 1.
+		The skip warnings of every file are sent to warn on each call, in file-name order, not only when rebuilt.
+		"""
+		version = version or self.version()
+		parts, warnings, _ = self._partitions(version)
+		for warning in warnings:
+			self.warn(warning)
+		return parts
+
+	def _partitions(self, version):
+		"""
+		(partitions, warnings of every file in file-name order, {csv path: build timings}) for this data version,
+		without sending the warnings.
+		"""
+		return utils.cached_by_fingerprint(('partitions', self.data_dir), version, lambda: self._update_partitions(version))
+
+	def _update_partitions(self, version):
+		file_paths = [os.path.join(self.data_dir, fp[0]) for fp in version]
+		build = functools.partial(build_partition, snapshot_dir=self.snapshot_dir, streaming=self.streaming, chunk_rows=self.chunk_rows)
+		parts = {}
+		all_warnings = []
+		timings = {}
+		# Each file's warnings are cached with its partition, so an unchanged file keeps reporting them
+		results = utils.cached_map('partition', build, file_paths, workers=self.workers, use_processes=self.use_processes)
+		for file_path, (part, warnings, timings[file_path]) in zip(file_paths, results):
+			all_warnings.extend(warnings)
+			if part is not None:
+				parts[file_path] = part
+		# Forget partitions (and their aggregates) of removed files
+		for kind in ('partition', 'partition_cube', 'partition_geo', 'partition_nic'):
+			utils.prune_cache(kind, file_paths)
+		prune_snapshots(self.snapshot_dir, file_paths)
+		return parts, all_warnings, timings
+
+	def ingest_timings(self, version=None):
+		"""
+		One row per CSV with how its partition was last built (build_partition timings): from its snapshot or the CSV,
+		and the milliseconds spent reading, cleaning, categorizing and writing the snapshot.
+		"""
+		version = version or self.version()
+		timings = self._partitions(version)[2]
+		return pd.DataFrame([{'file': os.path.basename(file_path), **row} for file_path, row in timings.items()])
+
+	def load(self, version=None):
+		"""
+		Returns the cleaned census frame: the partitions concatenated in file-name order.
+		Sends the skip warnings of partitions() on every call.
+		"""
+		version = version or self.version()
+		parts = self.partitions(version)
+		return utils.cached_by_fingerprint(('base', self.data_dir), version, lambda: self._combine_partitions(parts))
+
+	def _combine_partitions(self, parts):
+		"""
+		Concatenates the partitions, then swaps every cached partition for a view of its rows in the result,
+		so the cleaned data is held once instead of as partitions plus their concatenation.
+		"""
+		base = utils.concat_categorical(list(parts.values()))
+		start = 0
+		for file_path, part in list(parts.items()):
+			view = base.iloc[start:start + len(part)].reset_index(drop=True)
+			utils.replace_cached(('partition', file_path), lambda result, view=view: (view,) + result[1:])
+			# parts is the cached partitions() dict; the views hold the same rows
+			parts[file_path] = view
+			start += len(part)
+		return base
+
+	def _per_partition(self, kind, version, build):
+		"""build(partition) for every partition, cached per file fingerprint under kind."""
+		fingerprints = {fp[0]: fp for fp in version}
+		return [
+			utils.cached_by_fingerprint((kind, file_path), fingerprints[os.path.basename(file_path)], lambda part=part: build(part))
+			for file_path, part in self._partitions(version)[0].items()
+		]
+
+	def cube(self, version=None):
+		"""
+		Pre-aggregated worker counts per (geo level, state, state/district name, business category),
+		rolled up from a cached partial cube per partition.
+		"""
+		version = version or self.version()
+		return utils.cached_by_fingerprint(('cube', self.data_dir), version, lambda: utils.cube_rollup(
+			utils.concat_categorical(self._per_partition('partition_cube', version, build_worker_cube)),
+			CUBE_DIMS, worker_columns
+		))
+
+	def geo_index(self, version=None):
+		"""
+		State code -> state/district names -> row positions of the cleaned frame,
+		merged from a cached index per partition.
+		"""
+		version = version or self.version()
+		return utils.cached_by_fingerprint(('geo', self.data_dir), version, lambda: utils.merge_geo_indexes(
+			self._per_partition('partition_geo', version, lambda part: utils.build_geo_index(part, COL_STATE_CODE, COL_STATE_NAME)),
+			[len(part) for part in self._partitions(version)[0].values()]
+		))
+
+	def nic_index(self, version=None):
+		"""NIC division -> groups -> classes present in the data (utils.build_nic_index), from each partition's distinct codes."""
+		version = version or self.version()
+		return utils.cached_by_fingerprint(('nic', self.data_dir), version, lambda: nic_index(pd.concat(
+			self._per_partition('partition_nic', version, lambda part: part[[COL_NIC_CODE, COL_NIC_NAME]].drop_duplicates(COL_NIC_CODE)),
+			ignore_index=True
+		)))
+
+	def queries(self, version=None, backend=QUERY_BACKEND):
+		"""Selection and aggregation API for this data version, answered in memory ('pandas') or by SQL ('sql')."""
+		version = version or self.version()
+		if backend == 'sql':
+			try:
+				from . import sqlstore
+			except ImportError:  # imported as a top-level module
+				import sqlstore
+			return sqlstore.SQLQueries(self, version)
+		return PandasQueries(self, version)
+
+class PandasQueries:
+	"""
+	Sidebar selections and chart aggregates answered from the in-memory cleaned frame, cube and geography index.
+	sqlstore.SQLQueries has the same methods and return shapes.
+	"""
+	def __init__(self, census, version):
+		self.base = census.load(version)
+		self.cube = census.cube(version)
+		self.geo_index = census.geo_index(version)
+		self._nic_index = census.nic_index(version)
+
+	def states(self):
+		"""State names in order of their first row."""
+		return self.geo_index['states']
+
+	def nic_index(self):
+		return self._nic_index
+
+	def select_states(self, selected_states):
+		return select_states(self.geo_index, selected_states)
+
+	def select_categories(self, selected_states_code, selected_districts):
+		return select_categories(self.base, self.geo_index, selected_states_code, selected_districts)
+
+	def select_rows(self, selected_states_code, selected_states, selected_districts, selected_categories):
+		return select_rows(self.base, self.cube, self.geo_index, selected_states_code, selected_states, selected_districts, selected_categories)
+
+# --- Partitions ---
+def restore_partition(df):
+	"""Census dtypes for a partition read back from a snapshot written chunk by chunk."""
+	df = utils.apply_census_schema(df, category_columns, worker_columns)
+	if COL_NIC_CODE in df.columns:
+		df[COL_NIC_CODE] = df[COL_NIC_CODE].astype('int16')
+	return df
+
+def _timed(iterable, seconds, key):
+	"""Yields from iterable, adding the time spent producing each item to seconds[key]."""
+	iterator = iter(iterable)
+	while True:
+		start = time.perf_counter()
+		try:
+			item = next(iterator)
+		except StopIteration:
+			return
+		finally:
+			seconds[key] += time.perf_counter() - start
+		yield item
+
+def build_partition(file_path, snapshot_dir, streaming=False, chunk_rows=utils.CSV_CHUNK_ROWS):
+	"""
+	Cleaned rows of one CSV, read from its snapshot in snapshot_dir when the snapshot is current,
+	otherwise rebuilt (chunk by chunk if streaming) and snapshotted. Returns (partition or None, warnings, timings);
+	a file that cannot be read or cleaned (e.g. one without the NIC columns) is skipped with a warning.
+	timings has the source ('snapshot' or 'csv'), the rows and the milliseconds spent reading the snapshot or CSV,
+	cleaning (without categorizing), categorizing and writing the snapshot.
+	"""
+	snapshot_path = os.path.join(snapshot_dir, os.path.basename(file_path) + '.feather')
+	manifest = utils.snapshot_manifest([file_path])
+	seconds = dict.fromkeys(['read', 'clean', 'categorize', 'snapshot'], 0.0)
+	def result(part, warnings, source='csv'):
+		timings = {'source': source, 'rows': 0 if part is None else len(part)}
+		timings['read_ms'] = round(seconds['read'] * 1000, 3)
+		timings['clean_ms'] = round((seconds['clean'] - seconds['categorize']) * 1000, 3)
+		timings['categorize_ms'] = round(seconds['categorize'] * 1000, 3)
+		timings['snapshot_ms'] = round(seconds['snapshot'] * 1000, 3)
+		return part, warnings, timings
+
+	start = time.perf_counter()
+	part = utils.read_snapshot(snapshot_path, manifest, restore=restore_partition)
+	if part is not None:
+		seconds['read'] = time.perf_counter() - start
+		return result(part, [], source='snapshot')
+	warnings = []
+	skipped = []
+	def clean(df):
+		start = time.perf_counter()
+		try:
+			return utils.clean_census_data(df, category_columns, worker_columns, timings=seconds)
+		except Exception as e:
+			skipped.append(f"Skipped file due to error: {os.path.basename(file_path)} ({e})")
+			raise
+		finally:
+			seconds['clean'] += time.perf_counter() - start
+	if streaming:
+		def cleaned_chunks():
+			for chunk, warning in _timed(utils.iter_csv_chunks(file_path, chunk_rows), seconds, 'read'):
+				if warning:
+					warnings.append(warning)
+					continue
+				yield clean(chunk)
+		# Write each cleaned chunk to the snapshot as it arrives and memory-map the result,
+		# so the chunks are never held together; without pyarrow they are concatenated in memory.
+		start = time.perf_counter()
+		try:
+			os.makedirs(snapshot_dir, exist_ok=True)
+			rows = utils.write_snapshot_chunks(cleaned_chunks(), snapshot_path, manifest)
+		except Exception as e:
+			if skipped:
+				return result(None, skipped)
+			warnings = [f"Could not write data snapshot: {snapshot_path} ({e})"]
+			rows = None
+		if rows == 0:
+			return result(None, warnings)
+		if rows:
+			part = utils.read_snapshot(snapshot_path, manifest, restore=restore_partition)
+			# The snapshot time is what remains after reading and cleaning the chunks
+			seconds['snapshot'] = time.perf_counter() - start - seconds['read'] - seconds['clean']
+			if part is not None:
+				return result(part, warnings)
+			warnings = []
+		seconds.update(dict.fromkeys(seconds, 0.0))
+		try:
+			chunks = list(cleaned_chunks())
+		except Exception:
+			return result(None, skipped)
+		part = utils.concat_categorical(chunks) if chunks else None
+	else:
+		start = time.perf_counter()
+		df, warning = utils.load_csv_file(file_path)
+		seconds['read'] = time.perf_counter() - start
+		if warning:
+			warnings.append(warning)
+		try:
+			part = clean(df) if df is not None else None
+		except Exception:
+			return result(None, skipped)
+	if part is not None:
+		start = time.perf_counter()
+		try:
+			os.makedirs(snapshot_dir, exist_ok=True)
+			utils.write_snapshot(part, snapshot_path, manifest)
+		except Exception as e:
+			warnings.append(f"Could not write data snapshot: {snapshot_path} ({e})")
+		seconds['snapshot'] = time.perf_counter() - start
+	return result(part, warnings)
+
+def prune_snapshots(snapshot_dir, file_paths):
+	"""Deletes the snapshots in snapshot_dir of CSVs that are not in file_paths."""
+	if not os.path.isdir(snapshot_dir):
+		return
+	keep = {os.path.basename(file_path) + '.feather' for file_path in file_paths}
+	for file in os.listdir(snapshot_dir):
+		if file.endswith('.feather') and file not in keep:
+			for path in (file, file + '.manifest.json'):
+				try:
+					os.remove(os.path.join(snapshot_dir, path))
+				except OSError:
+					pass
+
+def build_worker_cube(base):
+	"""Sums all worker columns of base per (geo level, state code, India/States, business category)."""
+	return utils.build_cube(
+		base.assign(**{COL_GEO_LEVEL: utils.geo_levels(base[COL_STATE_NAME])}), CUBE_DIMS, worker_columns
+	)
+
+def build_worker_cube_streaming(chunks):
+	"""build_worker_cube over an iterable of cleaned chunks, keeping only one chunk and the partial cubes."""
+	cube = utils.concat_categorical([build_worker_cube(chunk) for chunk in chunks])
+	return utils.cube_rollup(cube, CUBE_DIMS, worker_columns)
+
+# --- Filtering ---
+def select_states(geo_index, selected_states):
+	"""Resolves selected states to their codes and the district dropdown options."""
+	selected_states_code = utils.geo_state_codes(geo_index, selected_states)
+	return selected_states_code, utils.geo_districts(geo_index, selected_states_code)
+
+def select_categories(base, geo_index, selected_states_code, selected_districts):
+	"""Business categories present in the selected districts."""
+	rows = utils.geo_rows(geo_index, selected_states_code, selected_districts)
+	return base[COL_BUSINESS_CATEGORY].iloc[rows].unique()
+
+def select_rows(base, cube, geo_index, selected_states_code, selected_states, selected_districts, selected_categories):
+	"""
+	Row-level and cube frames for a full sidebar selection, as a dict with
+	'district_rows', 'state_rows', 'rows' (both) and 'state_cube', 'district_cube', 'cube' (both).
+	"""
+	def category_rows(rows):
+		df = base.iloc[rows]
+		return df[df[COL_BUSINESS_CATEGORY].isin(selected_categories)]
+
+	# District rows: India/States starts with 'District' and matches selected districts
+	district_rows = category_rows(utils.geo_rows(geo_index, selected_states_code, selected_districts, level='DISTRICT'))
+	# State rows: India/States starts with 'STATE' and matches selected states
+	state_rows = category_rows(utils.geo_rows(geo_index, selected_states_code, selected_states, level='STATE'))
+
+	# Same selections applied to the pre-aggregated cube
+	state_cube = utils.cube_slice(cube, {
+		COL_GEO_LEVEL: ['STATE'], COL_STATE_CODE: selected_states_code,
+		COL_STATE_NAME: selected_states, COL_BUSINESS_CATEGORY: selected_categories
+	})
+	district_cube = utils.cube_slice(cube, {
+		COL_GEO_LEVEL: ['DISTRICT'], COL_STATE_CODE: selected_states_code,
+		COL_STATE_NAME: selected_districts, COL_BUSINESS_CATEGORY: selected_categories
+	})
+	return {
+		'district_rows': district_rows,
+		'state_rows': state_rows,
+		'rows': pd.concat([district_rows, state_rows]),
+		'state_cube': state_cube,
+		'district_cube': district_cube,
+		'cube': pd.concat([district_cube, state_cube]),
+	}
+
+def nic_index(code_names):
+	"""utils.build_nic_index of a frame of NIC codes and names, in row order."""
+	return utils.build_nic_index(code_names[COL_NIC_CODE], code_names[COL_NIC_NAME].astype(str))
+
+def nic_drilldown(rows, sorted_positions, index, level, parent=None, measures=None):
+	"""
+	Worker totals of rows per NIC level: every division (level 'Division'), the groups of division parent
+	('Group') or the classes of group parent ('Class'). The parent's rows are found by a range lookup on
+	sorted_positions (utils.nic_sorted_positions of the rows' codes) instead of comparing code strings.
+	Returns 'NIC Code', 'NIC' (display label) and the measures, ordered by code.
+	"""
+	measures = measures or worker_columns
+	rows = rows[[COL_NIC_CODE] + measures]
+	if parent is not None:
+		parent_level = {'Group': 'Division', 'Class': 'Group'}[level]
+		rows = rows.iloc[utils.nic_range_positions(sorted_positions, *utils.nic_code_range(parent_level, parent))]
+	summary = utils.nic_rollup(rows, COL_NIC_CODE, level, measures)
+	codes = summary[COL_NIC_CODE].tolist()
+	labels = [utils.nic_label(level, code) for code in codes]
+	if level == 'Class':
+		labels = [f"{label} {index['names'].get(code, '')}".strip() for label, code in zip(labels, codes)]
+	summary.insert(1, 'NIC', labels)
+	return summary
+
+# --- Aggregation ---
+def aggregate(cube_slice, by, measures):
+	"""Rolls a cube slice up to the by dimension(s), summing measures."""
+	return utils.cube_rollup(cube_slice, by, measures)
+
+def totals(cube_slice):
+	"""All worker totals of a cube slice as {column: int}."""
+	return utils.worker_totals(cube_slice, worker_columns)
@@ -0,0 +1,75 @@
+# instrument.py
+"""
+Lightweight per-stage instrumentation for the dashboard.
+
+A Profiler records, for each named stage of one script run, the wall time, rows processed,
+resident memory delta and the cache hits/misses counted by utils. Records can be shown in the
+dashboard's debug panel and appended to a JSON-lines log for offline analysis.
+"""
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+	from . import utils
+except ImportError:  # imported as a top-level module
+	import utils
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+def current_rss():
+	"""Resident memory of this process in bytes, or None where it cannot be read without psutil."""
+	if psutil is not None:
+		return psutil.Process().memory_info().rss
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, AttributeError):
+		return None
+
+class Profiler:
+	"""Collects stage records for one script run."""
+	def __init__(self):
+		self.run_id = uuid.uuid4().hex[:12]
+		self.records = []
+
+	def begin(self, name, rows=None):
+		"""Starts timing stage name and returns its record; pass it to end(). Set 'rows' on it when known."""
+		hits, misses = utils.cache_counts()
+		return {
+			'run_id': self.run_id, 'stage': name, 'rows': rows,
+			'_start': time.perf_counter(), '_rss': current_rss(), '_hits': hits, '_misses': misses,
+		}
+
+	def end(self, record):
+		"""Completes a record from begin() with wall time, memory delta and cache hits/misses."""
+		start, rss, hits, misses = (record.pop(key) for key in ('_start', '_rss', '_hits', '_misses'))
+		record['wall_ms'] = round((time.perf_counter() - start) * 1000, 3)
+		end_rss = current_rss()
+		record['mem_delta_mb'] = round((end_rss - rss) / 1024 ** 2, 3) if rss is not None and end_rss is not None else None
+		end_hits, end_misses = utils.cache_counts()
+		record['cache_hits'] = end_hits - hits
+		record['cache_misses'] = end_misses - misses
+		record['time'] = time.time()
+		self.records.append(record)
+		return record
+
+	@contextmanager
+	def stage(self, name, rows=None):
+		"""Times the with-block as stage name; the yielded record's 'rows' can be set inside the block."""
+		record = self.begin(name, rows)
+		try:
+			yield record
+		finally:
+			self.end(record)
+
+	def append_log(self, log_path):
+		"""Appends this run's records to log_path, one JSON object per line."""
+		with open(log_path, 'a', encoding='utf-8') as f:
+			for record in self.records:
+				f.write(json.dumps(record, default=str) + '\n')
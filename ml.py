@@ -0,0 +1,251 @@
+# ml.py
+"""
+Cached model fitting for the Machine Learning tab.
+
+Fitted models are keyed on a hash of the training data and hyperparameters, kept in memory
+and saved under cache_dir so they survive restarts. Both caches are bounded in bytes and evict the
+least recently used models first. scikit-learn is imported on first use.
+"""
+import copy
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pickle
+
+import pandas as pd
+
+# Fitted models / labels kept in memory, least recently used evicted first once their total size
+# exceeds MEMORY_CACHE_BYTES (the newest entry is always kept)
+MEMORY_CACHE_BYTES = 256 * 1024 ** 2
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+# Saved models in cache_dir, least recently used deleted first above this total size
+DISK_CACHE_BYTES = 1024 ** 3
+
+# Above this many rows clustering switches from KMeans to MiniBatchKMeans
+MINIBATCH_THRESHOLD = 10000
+MINIBATCH_SIZE = 4096
+
+# Background training: one job at a time so queued, superseded jobs can still be cancelled
+TRAINING_WORKERS = 1
+_pool = None
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def data_hash(*parts):
+	"""Stable hex digest of frames, series and plain values (e.g. hyperparameters)."""
+	h = hashlib.sha1()
+	for part in parts:
+		if isinstance(part, (pd.DataFrame, pd.Series)):
+			h.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+			h.update(repr(list(part.columns) if isinstance(part, pd.DataFrame) else part.name).encode())
+		else:
+			h.update(repr(part).encode())
+	return h.hexdigest()
+
+def _cache_path(cache_dir, kind, key):
+	return os.path.join(cache_dir, f"{kind}-{key}.joblib") if cache_dir else None
+
+def _load(cache_dir, kind, key):
+	"""Returns the cached object from memory, then disk, or None."""
+	with _memory_lock:
+		if (kind, key) in _memory_cache:
+			_memory_cache.move_to_end((kind, key))
+			return _memory_cache[(kind, key)][0]
+	path = _cache_path(cache_dir, kind, key)
+	if path and os.path.exists(path):
+		import joblib
+		try:
+			value = joblib.load(path)
+			nbytes = os.path.getsize(path)
+			# Loading counts as a use for the disk cache's eviction order
+			os.utime(path)
+		except Exception:
+			return None
+		_remember(kind, key, value, nbytes)
+		return value
+	return None
+
+def _remember(kind, key, value, nbytes=None):
+	"""Keeps value in memory; nbytes is its size, measured by pickling it when not given."""
+	if nbytes is None:
+		nbytes = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+	with _memory_lock:
+		_memory_cache[(kind, key)] = (value, nbytes)
+		_memory_cache.move_to_end((kind, key))
+		total = sum(size for _, size in _memory_cache.values())
+		while total > MEMORY_CACHE_BYTES and len(_memory_cache) > 1:
+			_, (_, size) = _memory_cache.popitem(last=False)
+			total -= size
+
+def _store(cache_dir, kind, key, value):
+	"""Keeps value in memory and, if cache_dir is set, writes it to disk atomically and prunes the disk cache."""
+	path = _cache_path(cache_dir, kind, key)
+	if not path:
+		_remember(kind, key, value)
+		return
+	import joblib
+	os.makedirs(cache_dir, exist_ok=True)
+	tmp_path = f"{path}.{threading.get_ident()}.tmp"
+	joblib.dump(value, tmp_path)
+	os.replace(tmp_path, path)
+	_remember(kind, key, value, os.path.getsize(path))
+	_prune_disk_cache(cache_dir, keep=path)
+
+def _prune_disk_cache(cache_dir, keep=None):
+	"""Deletes the least recently used model files in cache_dir until they fit in DISK_CACHE_BYTES."""
+	files = []
+	for file in os.listdir(cache_dir):
+		path = os.path.join(cache_dir, file)
+		if file.endswith('.joblib') and path != keep:
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			files.append((stat.st_mtime, stat.st_size, path))
+	total = sum(size for _, size, _ in files) + (os.path.getsize(keep) if keep else 0)
+	for _, size, path in sorted(files):
+		if total <= DISK_CACHE_BYTES:
+			break
+		try:
+			os.remove(path)
+		except OSError:
+			continue
+		total -= size
+
+def _forest_key(X_train, y_train, params):
+	"""Cache key of a forest; n_estimators is left out so smaller forests can be grown."""
+	return data_hash(X_train, y_train, sorted((k, v) for k, v in params.items() if k != 'n_estimators'))
+
+def cached_random_forest(X_train, y_train, cache_dir=None, **params):
+	"""Returns an already fitted forest for this data and parameters, or None. Never trains."""
+	clf = _load(cache_dir, 'forest', _forest_key(X_train, y_train, params))
+	if clf is not None and clf.n_estimators == params.get('n_estimators', 100):
+		return clf
+	return None
+
+def fit_random_forest(X_train, y_train, cache_dir=None, **params):
+	"""
+	Returns a RandomForestClassifier(**params) fitted on X_train, y_train.
+	A cached forest for the same data and parameters is reused; one with fewer trees
+	is grown with warm_start instead of being retrained from scratch.
+	"""
+	from sklearn.ensemble import RandomForestClassifier
+	n_estimators = params.pop('n_estimators', 100)
+	key = _forest_key(X_train, y_train, params)
+	clf = _load(cache_dir, 'forest', key)
+	if clf is not None and clf.n_estimators == n_estimators:
+		return clf
+	if clf is not None and clf.n_estimators < n_estimators:
+		# Grow a copy: the cached forest may be in use by other sessions
+		clf = copy.deepcopy(clf)
+		clf.set_params(warm_start=True, n_estimators=n_estimators)
+	else:
+		clf = RandomForestClassifier(n_estimators=n_estimators, **params)
+	clf.fit(X_train, y_train)
+	_store(cache_dir, 'forest', key, clf)
+	return clf
+
+def kmeans_sweep(X, cluster_counts, cache_dir=None, scale=False, minibatch=None, random_state=42, n_init=10):
+	"""
+	Cluster labels of X for every n_clusters in cluster_counts, computed in one run and cached as a whole.
+	Counts larger than the number of rows are skipped. scale standardizes the features first;
+	minibatch selects MiniBatchKMeans and defaults to True above MINIBATCH_THRESHOLD rows.
+	Returns {n_clusters: labels}.
+	"""
+	cluster_counts = [k for k in cluster_counts if k <= len(X)]
+	if minibatch is None:
+		minibatch = len(X) > MINIBATCH_THRESHOLD
+	key = data_hash(X, cluster_counts, scale, minibatch, random_state, n_init)
+	sweep = _load(cache_dir, 'kmeans', key)
+	if sweep is None:
+		from sklearn.cluster import KMeans, MiniBatchKMeans
+		values = X.to_numpy(dtype=float)
+		if scale:
+			from sklearn.preprocessing import StandardScaler
+			values = StandardScaler().fit_transform(values)
+		sweep = {}
+		for k in cluster_counts:
+			if minibatch:
+				model = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3, batch_size=MINIBATCH_SIZE)
+			else:
+				model = KMeans(n_clusters=k, random_state=random_state, n_init=n_init)
+			sweep[k] = model.fit_predict(values)
+		_store(cache_dir, 'kmeans', key, sweep)
+	return sweep
+
+def _get_pool():
+	global _pool
+	if _pool is None:
+		# A thread rather than a process: Streamlit installs the dashboard script as __main__, so a spawned
+		# worker would re-run it. Tree building releases the GIL, so the UI thread is not blocked.
+		_pool = ThreadPoolExecutor(max_workers=TRAINING_WORKERS, thread_name_prefix='model-training')
+	return _pool
+
+def submit_random_forest(X_train, y_train, cache_dir=None, subscriber=None, **params):
+	"""
+	Queues fit_random_forest on the background training pool and returns a job id.
+	Submitting the same data and parameters again returns the existing job; subscriber (e.g. a session id)
+	is recorded so cancel_job only cancels a job nobody else is waiting on. A job that trains successfully
+	is forgotten as soon as its forest is in the caches, and job_status then reports it 'missing'.
+	"""
+	job_id = data_hash(X_train, y_train, sorted(params.items()))
+	with _jobs_lock:
+		job = _jobs.get(job_id)
+		if job is None:
+			future = _get_pool().submit(fit_random_forest, X_train, y_train, cache_dir, **params)
+			job = _jobs[job_id] = {'future': future, 'submitted': time.monotonic(), 'subscribers': set()}
+			future.add_done_callback(functools.partial(_forget_trained, job_id))
+		job['subscribers'].add(subscriber)
+	return job_id
+
+def _forget_trained(job_id, future):
+	"""Done callback: fit_random_forest stored the forest in the caches, so only failed jobs need to be kept."""
+	if not future.cancelled() and future.exception() is None:
+		with _jobs_lock:
+			if _jobs.get(job_id, {}).get('future') is future:
+				del _jobs[job_id]
+
+def job_status(job_id):
+	"""
+	Returns (state, seconds since submission); state is 'queued', 'running', 'done' (failed, see job_result)
+	or 'missing' (trained and cached, cancelled or never submitted).
+	"""
+	with _jobs_lock:
+		job = _jobs.get(job_id)
+	if job is None:
+		return 'missing', 0.0
+	future = job['future']
+	state = 'done' if future.done() else 'running' if future.running() else 'queued'
+	return state, time.monotonic() - job['submitted']
+
+def job_result(job_id):
+	"""
+	Returns the fitted forest of a finished job and forgets the job, or None if it is still training
+	or no longer known (look the forest up with cached_random_forest then). Re-raises the training error if the job failed.
+	"""
+	with _jobs_lock:
+		job = _jobs.get(job_id)
+		if job is None or not job['future'].done():
+			return None
+		del _jobs[job_id]
+	# fit_random_forest already stored the forest in the memory and disk caches
+	return job['future'].result()
+
+def cancel_job(job_id, subscriber=None):
+	"""
+	Withdraws subscriber from a job. Once no subscriber is left, a queued job is cancelled and a finished
+	one forgotten; a job that already started keeps running in its worker and its model still lands in the caches.
+	"""
+	with _jobs_lock:
+		job = _jobs.get(job_id)
+		if job is None:
+			return
+		job['subscribers'].discard(subscriber)
+		if not job['subscribers'] and (job['future'].cancel() or job['future'].done()):
+			del _jobs[job_id]
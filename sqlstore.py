@@ -0,0 +1,286 @@
+# sqlstore.py
+"""
+Embedded SQL backend for the sidebar selections and chart aggregates.
+
+The cleaned census rows are kept in a local database file in the data folder, DuckDB when it is
+installed and SQLite (standard library) otherwise, with indexes on state code, India/States and
+business category. Selections and the cube slices behind the charts and Quick Stats run as queries,
+so only their results are held in memory. The database is synced file by file from the engine's
+partitions: a new, replaced or removed CSV only rewrites its own rows, in one transaction per file.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+	from . import engine, utils
+except ImportError:  # imported as top-level modules, e.g. by benchmark.py
+	import engine
+	import utils
+
+try:
+	import duckdb
+except ImportError:
+	duckdb = None
+
+# Bump when the table layout or the cleaned rows change so existing databases are rebuilt.
+STORE_SCHEMA_VERSION = 3
+TABLE = 'census'
+# Bookkeeping columns: geo level of the row, its source file and its position in that file
+COL_SOURCE_FILE = 'source_file'
+COL_FILE_ROW = 'file_row'
+INDEXED_COLUMNS = [engine.COL_STATE_CODE, engine.COL_STATE_NAME, engine.COL_BUSINESS_CATEGORY]
+
+# One connection per database file, shared by every session in the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+def quote(name):
+	"""Quotes a column name for SQL (names contain spaces, dashes and slashes)."""
+	return '"' + name.replace('"', '""') + '"'
+
+def in_clause(selections):
+	"""
+	SQL condition and parameters for [(column, values), ...], every column restricted to its values.
+	An empty value list matches nothing, like an empty multiselect.
+	"""
+	conditions = []
+	params = []
+	for column, values in selections:
+		values = list(values)
+		if not values:
+			return '1 = 0', []
+		conditions.append(f"{quote(column)} IN ({', '.join('?' * len(values))})")
+		params += values
+	return ' AND '.join(conditions), params
+
+class SQLStore:
+	"""A DuckDB or SQLite database file holding the cleaned rows of every census CSV of one data folder."""
+	def __init__(self, path):
+		self.path = path
+		# Guards the shared connection; reentrant so statements can run inside transaction()
+		self.lock = threading.RLock()
+		self._in_transaction = False
+		# Held for a whole sync, so concurrent sessions never insert the same file twice
+		self.sync_lock = threading.Lock()
+		if duckdb is not None:
+			self.con = duckdb.connect(path)
+		else:
+			import sqlite3
+			self.con = sqlite3.connect(path, check_same_thread=False)
+		self.columns = None
+		self._ensure_meta()
+
+	def query(self, sql, params=()):
+		"""Runs sql and returns the result as a DataFrame."""
+		with self.lock:
+			if duckdb is not None:
+				return self.con.execute(sql, list(params)).df()
+			return pd.read_sql_query(sql, self.con, params=list(params))
+
+	def execute(self, sql, params=()):
+		with self.lock:
+			self.con.execute(sql, list(params))
+			if duckdb is None and not self._in_transaction:
+				self.con.commit()
+
+	@contextmanager
+	def transaction(self):
+		"""Runs the statements of the with-block as one transaction, rolled back if the block raises."""
+		with self.lock:
+			self.con.execute('BEGIN TRANSACTION')
+			self._in_transaction = True
+			try:
+				yield
+				self.con.commit()
+			except BaseException:
+				self.con.rollback()
+				# A table created in the rolled back transaction is gone again
+				self.columns = self.columns if self._table_exists() else None
+				raise
+			finally:
+				self._in_transaction = False
+
+	def _ensure_meta(self):
+		self.execute('CREATE TABLE IF NOT EXISTS store_files (source_file TEXT PRIMARY KEY, fingerprint TEXT)')
+		self.execute('CREATE TABLE IF NOT EXISTS store_meta (schema_version INTEGER)')
+		version = self.query('SELECT schema_version FROM store_meta')
+		if version.empty or int(version.iloc[0, 0]) != STORE_SCHEMA_VERSION:
+			self.execute(f'DROP TABLE IF EXISTS {TABLE}')
+			self.execute('DELETE FROM store_files')
+			self.execute('DELETE FROM store_meta')
+			self.execute('INSERT INTO store_meta VALUES (?)', [STORE_SCHEMA_VERSION])
+		if self._table_exists():
+			self.columns = [col for col in self.query(f'SELECT * FROM {TABLE} LIMIT 0').columns]
+
+	def _table_exists(self):
+		if duckdb is not None:
+			sql = "SELECT table_name FROM information_schema.tables WHERE table_name = ?"
+		else:
+			sql = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+		return not self.query(sql, [TABLE]).empty
+
+	def _create_table(self, part):
+		columns = [engine.COL_GEO_LEVEL] + [col for col in part.columns if col != engine.COL_GEO_LEVEL]
+		types = ['INTEGER' if pd.api.types.is_integer_dtype(part[col]) else 'TEXT' for col in columns[1:]]
+		column_sql = ', '.join(f'{quote(col)} {sql_type}' for col, sql_type in zip(columns, ['TEXT'] + types))
+		self.execute(f'CREATE TABLE {TABLE} ({column_sql}, {COL_SOURCE_FILE} TEXT, {COL_FILE_ROW} INTEGER)')
+		for i, col in enumerate(INDEXED_COLUMNS + [COL_SOURCE_FILE]):
+			self.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_idx{i} ON {TABLE} ({quote(col)})')
+		self.columns = columns + [COL_SOURCE_FILE, COL_FILE_ROW]
+
+	def sync(self, census, version):
+		"""
+		Brings the table in line with the CSVs of version, one file per transaction: a removed file's rows
+		are deleted, a changed or new file's rows are replaced by its partition, together with its store_files
+		record. Concurrent syncs of the same store run one after the other.
+		"""
+		with self.sync_lock:
+			stored = dict(self.query('SELECT source_file, fingerprint FROM store_files').itertuples(index=False))
+			current = {fp[0]: repr(fp) for fp in version}
+			for file in stored:
+				if file not in current:
+					with self.transaction():
+						self._delete(file)
+			for file, fingerprint in current.items():
+				if stored.get(file) == fingerprint:
+					continue
+				part, warnings, _ = engine.build_partition(
+					os.path.join(census.data_dir, file), census.snapshot_dir, streaming=census.streaming, chunk_rows=census.chunk_rows
+				)
+				for warning in warnings:
+					census.warn(warning)
+				with self.transaction():
+					self._delete(file)
+					if part is not None:
+						self._insert(file, part)
+					self.execute('INSERT INTO store_files VALUES (?, ?)', [file, fingerprint])
+
+	def _delete(self, file):
+		"""Deletes the rows and the store_files record of file."""
+		if self.columns is not None:
+			self.execute(f'DELETE FROM {TABLE} WHERE {COL_SOURCE_FILE} = ?', [file])
+		self.execute('DELETE FROM store_files WHERE source_file = ?', [file])
+
+	def _insert(self, file, part):
+		rows = part.assign(**{
+			engine.COL_GEO_LEVEL: utils.geo_levels(part[engine.COL_STATE_NAME]),
+			COL_SOURCE_FILE: file,
+			COL_FILE_ROW: range(len(part)),
+		})
+		if self.columns is None:
+			self._create_table(part)
+		columns = [col for col in self.columns if col in rows.columns]
+		rows = rows[columns]
+		# Categoricals go in as their labels; counts as plain Python ints
+		rows = rows.astype({col: object for col in columns if isinstance(rows[col].dtype, pd.CategoricalDtype)})
+		column_sql = ', '.join(quote(col) for col in columns)
+		with self.lock:
+			if duckdb is not None:
+				self.con.register('partition_rows', rows)
+				self.con.execute(f'INSERT INTO {TABLE} ({column_sql}) SELECT {column_sql} FROM partition_rows')
+				self.con.unregister('partition_rows')
+			else:
+				self.con.executemany(
+					f"INSERT INTO {TABLE} ({column_sql}) VALUES ({', '.join('?' * len(columns))})",
+					rows.itertuples(index=False, name=None)
+				)
+				if not self._in_transaction:
+					self.con.commit()
+
+def get_store(census, version):
+	"""The synced store of census.data_dir for this data version."""
+	path = os.path.join(census.data_dir, 'census.duckdb' if duckdb is not None else 'census.sqlite')
+	with _stores_lock:
+		store = _stores.get(path)
+		if store is None:
+			store = _stores[path] = SQLStore(path)
+	utils.cached_by_fingerprint(('sql', path), version, lambda: store.sync(census, version))
+	return store
+
+class SQLQueries:
+	"""engine.PandasQueries answered by queries against the synced SQL store."""
+	def __init__(self, census, version):
+		self.store = get_store(census, version)
+		self.version = version
+
+	def _first_seen(self, columns, where, params):
+		"""Distinct combinations of columns among the rows matching where, in order of their first row."""
+		cols = ', '.join(quote(col) for col in columns)
+		return self.store.query(
+			f'SELECT {cols} FROM ('
+			f'SELECT {cols}, {COL_SOURCE_FILE}, {COL_FILE_ROW}, '
+			f'ROW_NUMBER() OVER (PARTITION BY {cols} ORDER BY {COL_SOURCE_FILE}, {COL_FILE_ROW}) AS first_seen '
+			f'FROM {TABLE} WHERE {where}'
+			f') AS ranked WHERE first_seen = 1 ORDER BY {COL_SOURCE_FILE}, {COL_FILE_ROW}', params
+		)
+
+	def states(self):
+		"""State names in order of their first row."""
+		return self._first_seen([engine.COL_STATE_NAME], f'{quote(engine.COL_GEO_LEVEL)} = ?', ['STATE'])[engine.COL_STATE_NAME].tolist()
+
+	def nic_index(self):
+		"""NIC hierarchy of the stored rows, built from their distinct codes once per data version."""
+		return utils.cached_by_fingerprint(('sql_nic', self.store.path), self.version, lambda: engine.nic_index(
+			self._first_seen([engine.COL_NIC_CODE, engine.COL_NIC_NAME], '1 = 1', [])
+		))
+
+	def select_states(self, selected_states):
+		"""Codes of the selected states and the non-state names under them, in order of their first row."""
+		where, params = in_clause([(engine.COL_STATE_NAME, selected_states)])
+		pairs = self._first_seen([engine.COL_STATE_NAME, engine.COL_STATE_CODE], where, params)
+		name_codes = {}
+		for name, code in pairs.itertuples(index=False):
+			name_codes.setdefault(name, []).append(code)
+		codes = list(dict.fromkeys(code for name in selected_states for code in name_codes.get(name, [])))
+		where, params = in_clause([(engine.COL_STATE_CODE, codes)])
+		districts = self._first_seen(
+			[engine.COL_STATE_NAME],
+			f"{where} AND {quote(engine.COL_GEO_LEVEL)} != ? AND TRIM({quote(engine.COL_STATE_NAME)}) != ''",
+			params + ['STATE']
+		)
+		return codes, districts[engine.COL_STATE_NAME].tolist()
+
+	def select_categories(self, selected_states_code, selected_districts):
+		"""Business categories present in the selected districts, in order of their first row."""
+		where, params = in_clause([(engine.COL_STATE_CODE, selected_states_code), (engine.COL_STATE_NAME, selected_districts)])
+		return self._first_seen([engine.COL_BUSINESS_CATEGORY], where, params)[engine.COL_BUSINESS_CATEGORY].tolist()
+
+	def _where(self, level, codes, names, categories):
+		where, params = in_clause([
+			(engine.COL_STATE_CODE, codes), (engine.COL_STATE_NAME, names), (engine.COL_BUSINESS_CATEGORY, categories)
+		])
+		return f'{quote(engine.COL_GEO_LEVEL)} = ? AND {where}', [level] + params
+
+	def _rows(self, level, codes, names, categories):
+		where, params = self._where(level, codes, names, categories)
+		columns = ', '.join(quote(col) for col in self.store.columns if col not in (engine.COL_GEO_LEVEL, COL_SOURCE_FILE, COL_FILE_ROW))
+		return self.store.query(
+			f'SELECT {columns} FROM {TABLE} WHERE {where} ORDER BY {COL_SOURCE_FILE}, {COL_FILE_ROW}', params
+		)
+
+	def _cube(self, level, codes, names, categories):
+		where, params = self._where(level, codes, names, categories)
+		dims = ', '.join(quote(dim) for dim in engine.CUBE_DIMS)
+		sums = ', '.join(f'SUM({quote(col)}) AS {quote(col)}' for col in engine.worker_columns)
+		return self.store.query(f'SELECT {dims}, {sums} FROM {TABLE} WHERE {where} GROUP BY {dims} ORDER BY {dims}', params)
+
+	def select_rows(self, selected_states_code, selected_states, selected_districts, selected_categories):
+		"""Same dict as engine.select_rows; the cube slices are GROUP BY queries over the selected rows."""
+		def frames(query, items):
+			return [
+				utils.apply_census_schema(query(level, selected_states_code, names, selected_categories), engine.category_columns, engine.worker_columns)
+				for level, names in items
+			]
+		district_rows, state_rows = frames(self._rows, [('DISTRICT', selected_districts), ('STATE', selected_states)])
+		district_cube, state_cube = frames(self._cube, [('DISTRICT', selected_districts), ('STATE', selected_states)])
+		return {
+			'district_rows': district_rows,
+			'state_rows': state_rows,
+			'rows': pd.concat([district_rows, state_rows], ignore_index=True),
+			'state_cube': state_cube,
+			'district_cube': district_cube,
+			'cube': pd.concat([district_cube, state_cube], ignore_index=True),
+		}
@@ -1,64 +1,18 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import re
 import os
-import pandas.errors
+import uuid
 import streamlit.components.v1 as components
 from modules import utils
-
-# Column name constants
-COL_STATE_CODE = 'State Code'
-COL_NIC_NAME = 'NIC Name'
-COL_BUSINESS_CATEGORY = 'Business Category'
-COL_DISTRICT_CODE = 'District Code'
-COL_STATE_NAME = 'India/States'
-COL_MAIN_WORKERS = 'Main Workers - Total -  Persons'
-# --- Added constants for repeated worker columns ---
-COL_MAIN_WORKERS_TOTAL_MALES = 'Main Workers - Total - Males'
-COL_MAIN_WORKERS_TOTAL_FEMALES = 'Main Workers - Total - Females'
-COL_MARGINAL_WORKERS_TOTAL_PERSONS = 'Marginal Workers - Total -  Persons'
-COL_MARGINAL_WORKERS_TOTAL_MALES = 'Marginal Workers - Total - Males'
-COL_MARGINAL_WORKERS_TOTAL_FEMALES = 'Marginal Workers - Total - Females'
-
-def merge_csvs_from_dir(data_dir):
-	"""
-	Reads and merges all CSVs in a directory, normalizes columns.
-	Returns merged DataFrame with canonical columns.
-	"""
-	
-	csv_files = [f for f in os.listdir(data_dir) if f.endswith('.csv')]
-	df_list = []
-	for file in csv_files:
-		file_path = os.path.join(data_dir, file)
-		try:
-			df = try_read_csv(file_path)
-			if df is None:
-				warn_streamlit(f"Skipped file due to encoding issues: {file}")
-				continue
-		except pandas.errors.EmptyDataError:
-			warn_streamlit(f"Skipped empty file: {file}")
-			continue
-		except Exception as e:
-			warn_streamlit(f"Skipped file due to error: {file} ({e})")
-			continue
-		if df.empty or df.shape[1] == 0:
-			warn_streamlit(f"Skipped file with no columns: {file}")
-			continue
-		df_list.append(df)
-	if df_list:
-		merged_df = pd.concat(df_list, ignore_index=True)
-		return merged_df
-	
-def try_read_csv(file_path):
-	"""Try reading a CSV file with multiple encodings."""
-	encodings = ['utf-8', 'cp1252', 'latin1']
-	for enc in encodings:
-		try:
-			return pd.read_csv(file_path, encoding=enc)
-		except UnicodeDecodeError:
-			continue
-	return None
+from modules import ml
+from modules import engine
+from modules import instrument
+from modules.engine import (
+	COL_BUSINESS_CATEGORY, COL_STATE_NAME, COL_NIC_CODE,
+	COL_MAIN_WORKERS, COL_MAIN_WORKERS_TOTAL_MALES, COL_MAIN_WORKERS_TOTAL_FEMALES,
+	COL_MARGINAL_WORKERS_TOTAL_PERSONS, COL_MARGINAL_WORKERS_TOTAL_MALES, COL_MARGINAL_WORKERS_TOTAL_FEMALES,
+	worker_columns,
+)
 
 def warn_streamlit(message):
 	"""Show a warning in Streamlit if available."""
@@ -69,66 +23,17 @@ def warn_streamlit(message):
 		pass
 
 # Load the data
-file_path = 'C:\\WA\\POC\\Python\\IHRGV\\data\\DDW_B18_1200_NIC_FINAL_STATE_ARUNACHAL_PRADESH-2011.csv'
-data_dir = "C:\\WA\\POC\\Python\\IHRGV\\data" 
-data = merge_csvs_from_dir(data_dir)
-
-
-# Clean the data
-cleaned_data = data.dropna(how='all')
-cleaned_data.columns = [col.strip() for col in cleaned_data.columns]
-
-# Remove special characters and trim spaces from key columns
-for col in ['State Code', 'District Code', 'India/States', 'Division', 'Group', 'Class']:
-    if col in cleaned_data.columns:
-        cleaned_data[col] = cleaned_data[col].astype(str).str.replace(r'[^\w\s-]', '', regex=True).str.strip()
-
-
-
-
-# Clean the columns by removing backticks, trimming spaces, and zero-padding
-for col, width in zip(['Division', 'Group', 'Class'], [2, 3, 4]):
-    cleaned_data[col] = cleaned_data[col].astype(str).str.replace('`', '').str.strip().str.zfill(width)
-
-cleaned_data[COL_NIC_NAME] = cleaned_data[COL_NIC_NAME].astype(str).str.strip()
-
-
-
-
-# Categorize business activities using NLP keywords
-
-categories = {
-    'Retail': ['stalls', 'markets', 'via', 'or', 'food', 'beverages', 'tobacco', 'motor', 'non-specialized', 'household'],
-    'Poultry': ['raising', 'poultry'],
-    'Agriculture': ['growing', 'crops', 'fruits', 'crop', 'forestry', 'support', 'rice', 'non-perennial', 'perennial', 'post-harvest'],
-    'Manufacturing': ['machinery', 'vehicles', 'metal', 'apparel', 'basic', 'motor', 'chemical', 'paper', 'rubber', 'animal'],
-    'Education': ['education', 'secondary', 'cultural', 'educational', 'support', 'general', 'higher', 'primary', 'regulation', 'providing'],
-    'Healthcare': ['health', 'mental', 'transportation', 'human', 'residential', 'care', 'retardation', 'hospital', 'medical', 'dental']
-}
-
-
-
-def categorize_activity(nic_name):
-    nic_name_lower = str(nic_name).lower()
-    for category, keywords in categories.items():
-        if any(re.search(keyword, nic_name_lower) for keyword in keywords):
-            return category
-    return 'Other'
-
-# Assign business category before filtering out 'Total' row
-cleaned_data[COL_BUSINESS_CATEGORY] = cleaned_data[COL_NIC_NAME].apply(categorize_activity)
-
-# Remove the 'Total' row from the cleaned data for all downstream analysis
-base_data = cleaned_data[~(
-    (cleaned_data['Division'] == '00') &
-    (cleaned_data['Group'] == '000') &
-    (cleaned_data['Class'] == '0000') &
-    (cleaned_data[COL_NIC_NAME].str.lower() == 'total')
-)]
-
-
-
-
+data_dir = engine.DEFAULT_DATA_DIR
+data_engine = engine.CensusEngine(data_dir, warn=warn_streamlit)
+# Fitted models are saved here, keyed on their training data and hyperparameters
+MODEL_CACHE_DIR = data_engine.model_cache_dir
+# Per-stage wall time, rows, memory delta and cache hits of this run, for the profiling panel at the end
+profiler = instrument.Profiler()
+PROFILE_LOG = os.path.join(data_dir, 'profile_log.jsonl')
+with profiler.stage('load'):
+	data_version = data_engine.version()
+	# Sidebar selections and cube slices, answered in memory or by the embedded SQL backend (engine.QUERY_BACKEND)
+	census = data_engine.queries(data_version)
 
 # --- Streamlit UI Enhancements ---
 st.set_page_config(
@@ -138,13 +43,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Compute states, districts, categories_list for sidebar metrics and filters
-state_mask = base_data[COL_STATE_NAME].str.upper().str.startswith('STATE')
-states = base_data.loc[state_mask, COL_STATE_NAME].unique()
-districts = base_data[COL_STATE_NAME].dropna().astype(str).str.strip()
-districts = districts[(districts != '') & (~districts.str.upper().str.startswith('STATE'))]
-districts = districts.unique()
-categories_list = base_data[COL_BUSINESS_CATEGORY].unique() if COL_BUSINESS_CATEGORY in base_data.columns else []
+# Compute states for sidebar metrics and filters
+states = census.states()
 
 
 st.markdown("""
@@ -207,67 +107,61 @@ st.markdown("""
 
 selected_states = st.sidebar.multiselect('🗂️ Select State(s):', states, default=states)
 
-# Based selected  state  to filter the district 
-dfs = base_data[base_data[COL_STATE_NAME].isin(selected_states)]
-selected_states_code=dfs[COL_STATE_CODE].unique()
-base_data = base_data[base_data[COL_STATE_CODE].isin(selected_states_code)]
-
-# Use only values from India/States column that start with 'District' for the district dropdown
-districts = base_data[COL_STATE_NAME].dropna().astype(str).str.strip()
-districts = districts[(districts != '') & (~districts.str.upper().str.startswith('STATE'))]
-districts = districts.unique()
+# Each sidebar stage is memoized on the data version and its canonical selections,
+# so reruns that only change a chart view or a model setting skip filtering entirely.
+states_key = (data_version, 'states', utils.selection_key(selected_states))
+with profiler.stage('select_states') as stage:
+	selected_states_code, districts = utils.filter_cache.get_or_build(
+		states_key, lambda: census.select_states(selected_states)
+	)
+	stage['rows'] = len(districts)
 selected_districts = st.sidebar.multiselect('🏙️ Select District(s):', districts, default=districts)
 
 
-df2 = base_data[base_data[COL_STATE_NAME].isin(selected_districts)]
-categories_list = df2[COL_BUSINESS_CATEGORY].unique()
+districts_key = states_key + (utils.selection_key(selected_districts),)
+with profiler.stage('select_categories') as stage:
+	categories_list = utils.filter_cache.get_or_build(
+		districts_key, lambda: census.select_categories(selected_states_code, selected_districts)
+	)
+	stage['rows'] = len(categories_list)
 selected_categories = st.sidebar.multiselect('🏭 Select Business Category:', categories_list, default=categories_list)
 
-# Filter data for district chart: only rows where India/States starts with 'District' and matches selected districts
-district_mask = base_data[COL_STATE_NAME].astype(str).str.upper().str.startswith('DISTRICT')
-filtered_district_data = base_data[district_mask & base_data[COL_STATE_NAME].isin(selected_districts) & base_data[COL_BUSINESS_CATEGORY].isin(selected_categories)]
-
-# Filter data for state chart: only rows where India/States starts with 'STATE' and matches selected states
-state_mask = base_data[COL_STATE_NAME].astype(str).str.upper().str.startswith('STATE')
-filtered_state_data = base_data[state_mask & base_data[COL_STATE_NAME].isin(selected_states) & base_data[COL_BUSINESS_CATEGORY].isin(selected_categories)]
-
-# Filtered data for table: union of both
-filtered_data = pd.concat([filtered_district_data, filtered_state_data])
+rows_key = districts_key + (utils.selection_key(selected_categories),)
+with profiler.stage('select_rows') as stage:
+	selection = utils.filter_cache.get_or_build(rows_key, lambda: census.select_rows(
+		selected_states_code, selected_states, selected_districts, selected_categories
+	))
+	stage['rows'] = len(selection['rows'])
+# Filtered rows for the table and ML tab; charts and Quick Stats roll up the cube slices instead
+filtered_data = selection['rows']
+state_cube = selection['state_cube']
+district_cube = selection['district_cube']
+filtered_cube = selection['cube']
 
 
 # Debug: Show if any 'Total' rows remain
 
 # Summarize data
-category_summary = filtered_data.groupby(COL_BUSINESS_CATEGORY)[COL_MAIN_WORKERS].sum().reset_index()
-district_summary = filtered_district_data.groupby(COL_STATE_NAME)[COL_MAIN_WORKERS].sum().reset_index()
-state_summary = filtered_state_data.groupby(COL_STATE_NAME)[COL_MAIN_WORKERS].sum().reset_index()
+with profiler.stage('summaries', rows=len(filtered_cube)):
+	category_summary = engine.aggregate(filtered_cube, COL_BUSINESS_CATEGORY, COL_MAIN_WORKERS)
+	district_summary = engine.aggregate(district_cube, COL_STATE_NAME, COL_MAIN_WORKERS)
+	state_summary = engine.aggregate(state_cube, COL_STATE_NAME, COL_MAIN_WORKERS)
 
 # --- Quick Stats in Main Header ---
-worker_columns = [
-        'Main Workers - Total -  Persons', COL_MAIN_WORKERS_TOTAL_MALES, COL_MAIN_WORKERS_TOTAL_FEMALES,
-        'Main Workers - Rural -  Persons', 'Main Workers - Rural -  Males', 'Main Workers - Rural -  Females',
-        'Main Workers - Urban -  Persons', 'Main Workers - Urban -  Males', 'Main Workers - Urban -  Females',
-        COL_MARGINAL_WORKERS_TOTAL_PERSONS, COL_MARGINAL_WORKERS_TOTAL_MALES, COL_MARGINAL_WORKERS_TOTAL_FEMALES,
-        'Marginal Workers - Rural -  Persons', 'Marginal Workers - Rural -  Males', 'Marginal Workers - Rural -  Females',
-        'Marginal Workers - Urban -  Persons', 'Marginal Workers - Urban -  Males', 'Marginal Workers - Urban -  Females'
-]
-
-def safe_sum(col):
-	if col in filtered_data.columns:
-		intval = int(pd.to_numeric(filtered_data[col], errors='coerce').fillna(0).sum())
-		return intval
-	return 0
-
-main_total = safe_sum('Main Workers - Total -  Persons')
-main_males = safe_sum(COL_MAIN_WORKERS_TOTAL_MALES)
-main_females = safe_sum(COL_MAIN_WORKERS_TOTAL_FEMALES)
-main_rural = safe_sum('Main Workers - Rural -  Persons')
-main_urban = safe_sum('Main Workers - Urban -  Persons')
-marginal_total = safe_sum(COL_MARGINAL_WORKERS_TOTAL_PERSONS)
-marginal_males = safe_sum(COL_MARGINAL_WORKERS_TOTAL_MALES)
-marginal_females = safe_sum(COL_MARGINAL_WORKERS_TOTAL_FEMALES)
-marginal_rural = safe_sum('Marginal Workers - Rural -  Persons')
-marginal_urban = safe_sum('Marginal Workers - Urban -  Persons')
+# All 18 worker totals in one pass over the filtered cube, cached per data version and selection
+with profiler.stage('quick_stats', rows=len(filtered_cube)):
+	worker_stats = utils.cached_worker_totals(rows_key, filtered_cube, worker_columns)
+
+main_total = worker_stats['Main Workers - Total -  Persons']
+main_males = worker_stats[COL_MAIN_WORKERS_TOTAL_MALES]
+main_females = worker_stats[COL_MAIN_WORKERS_TOTAL_FEMALES]
+main_rural = worker_stats['Main Workers - Rural -  Persons']
+main_urban = worker_stats['Main Workers - Urban -  Persons']
+marginal_total = worker_stats[COL_MARGINAL_WORKERS_TOTAL_PERSONS]
+marginal_males = worker_stats[COL_MARGINAL_WORKERS_TOTAL_MALES]
+marginal_females = worker_stats[COL_MARGINAL_WORKERS_TOTAL_FEMALES]
+marginal_rural = worker_stats['Marginal Workers - Rural -  Persons']
+marginal_urban = worker_stats['Marginal Workers - Urban -  Persons']
 
 st.markdown(f"""
 <div style='display: flex; flex-wrap: wrap; gap: 2em; align-items: flex-start; margin-bottom: 1.5em;'>
@@ -291,15 +185,65 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
+# --- Chart helpers ---
+# Above this many bars, a per-bar color (one Plotly trace per bar) is replaced by a single trace
+MAX_COLOR_TRACES = 20
+# Scatter matrices are drawn from a random sample of at most this many points
+SCATTER_MATRIX_MAX_POINTS = 500
+
+def cached_figure(view, build):
+	"""Figure for one chart view of the current selection, built once per data version and selection."""
+	return utils.figure_cache.get_or_build(rows_key + ('figure',) + (view if isinstance(view, tuple) else (view,)), build)
+
+def bar_chart(df, x, y, color=None, **kwargs):
+	"""px.bar that colors bars individually only while the color column has few distinct values."""
+	import plotly.express as px
+	if color is not None and df[color].nunique() > MAX_COLOR_TRACES:
+		color = None
+	return px.bar(df, x=x, y=y, color=color, **kwargs)
+
 # --- Wizard/Tab UI ---
-wizard_tab = st.tabs(["1️⃣ Data Overview", "2️⃣ Visualizations", "3️⃣ Machine Learning"])
+# Only the open tab runs: plotly and scikit-learn are imported, and models fitted, when their tab is selected
+wizard_tab = st.tabs(["1️⃣ Data Overview", "2️⃣ Visualizations", "3️⃣ Machine Learning"], key='wizard_tab', on_change='rerun')
 
 # --- Tab 1: Data Overview ---
 with wizard_tab[0]:
-	st.markdown('Use the filters in the sidebar to customize the data below. You can sort and search the table interactively.')
-	st.dataframe(filtered_data, use_container_width=True)
-	with st.expander("See sample of filtered data", expanded=False):
-		st.dataframe(filtered_data.head(10), use_container_width=True)
+	if wizard_tab[0].open:
+		st.markdown('Use the filters in the sidebar to customize the data below. Sorting and search run on the server; only the visible page is sent to the browser.')
+		# The integer NIC Code duplicates Class; it is only used for the NIC drill-down lookups
+		table_columns = [col for col in filtered_data.columns if col != COL_NIC_CODE]
+		search_col, sort_col, order_col = st.columns([3, 3, 1])
+		search_text = search_col.text_input("🔎 Search", key='table_search', placeholder="State, district, NIC name or category")
+		sort_by = sort_col.selectbox("Sort by", ["(none)"] + table_columns, key='table_sort')
+		descending = order_col.toggle("Descending", key='table_descending')
+		shown_columns = st.multiselect("Columns", table_columns, default=table_columns, key='table_columns')
+
+		# Sort order and search hits are cached per selection, so paging only slices positions
+		table_stage = profiler.begin('table', rows=len(filtered_data))
+		search_text = search_text.strip().lower()
+		matches = utils.filter_cache.get_or_build(
+			rows_key + ('search', search_text), lambda: utils.search_positions(filtered_data, search_text)
+		)
+		if sort_by == "(none)":
+			table_rows = matches
+		else:
+			order = utils.filter_cache.get_or_build(
+				rows_key + ('sort', sort_by, descending), lambda: utils.sort_positions(filtered_data, sort_by, ascending=not descending)
+			)
+			table_rows = utils.filter_cache.get_or_build(
+				rows_key + ('table', search_text, sort_by, descending), lambda: utils.table_positions(order, matches)
+			)
+
+		page_col, size_col = st.columns([3, 1])
+		page_size = size_col.selectbox("Rows per page", [25, 50, 100, 250], index=1, key='table_page_size')
+		page_count = max(1, -(-len(table_rows) // page_size))
+		if st.session_state.get('table_page', 1) > page_count:
+			st.session_state['table_page'] = 1
+		page = page_col.number_input("Page", min_value=1, max_value=page_count, key='table_page')
+		st.dataframe(utils.table_page(filtered_data, table_rows, page, page_size, shown_columns), use_container_width=True)
+		first_row = (page - 1) * page_size
+		st.caption(f"Rows {min(first_row + 1, len(table_rows)):,}–{min(first_row + page_size, len(table_rows)):,} of {len(table_rows):,} (page {page} of {page_count})")
+		profiler.end(table_stage)
 
 
 
@@ -307,236 +251,333 @@ with wizard_tab[0]:
 # --- Tab 2: Visualizations ---
 
 with wizard_tab[1]:
-    viz_options = [
-        "👷 Main Workers",
-        "🧑‍🌾 Marginal Workers",
-        "📊 Combined Main vs Marginal",
-        "🏞️ Main: Rural/Urban",
-        "👫 Main: Male vs Female",
-        "🏞️ Marginal: Rural/Urban",
-        "👫 Marginal: Male vs Female"
-    ]
-    viz_view = st.selectbox(
-        "<span style='font-size:1.1em; font-weight:600;'>Select Visualization View:</span>",
-        viz_options,
-        key="viz_view_select",
-        format_func=lambda x: x,
-        help="Choose a visualization type to explore different aspects of the workforce."
-    )
-    st.markdown("""
-    <style>
-    .stSelectbox > div[data-baseweb="select"] {
-        background: #f8fafc;
-        border-radius: 8px;
-        padding: 0.5em 1em;
-        font-size: 1.1em;
-        font-weight: 600;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.04);
-        margin-bottom: 1.2em;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
-    def group_sum(df, group_col, sum_col):
-        return df.groupby(group_col)[sum_col].sum().reset_index()
-
-    def group_sum_multi(df, group_col, sum_cols):
-        return df.groupby(group_col)[sum_cols].sum().reset_index()
-
-    if viz_view == "👷 Main Workers":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Main Workers by State</span>", unsafe_allow_html=True)
-        main_state = group_sum(filtered_state_data, COL_STATE_NAME, COL_MAIN_WORKERS)
-        fig = px.bar(main_state, x=COL_STATE_NAME, y=COL_MAIN_WORKERS, color=COL_STATE_NAME)
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Main Workers by District</span>", unsafe_allow_html=True)
-        main_district = group_sum(filtered_district_data, COL_STATE_NAME, COL_MAIN_WORKERS)
-        fig = px.bar(main_district, x=COL_STATE_NAME, y=COL_MAIN_WORKERS, color=COL_STATE_NAME)
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>📊 Main Workers by Business Category</span>", unsafe_allow_html=True)
-        main_cat = group_sum(filtered_data, COL_BUSINESS_CATEGORY, COL_MAIN_WORKERS)
-        fig = px.bar(main_cat, x=COL_BUSINESS_CATEGORY, y=COL_MAIN_WORKERS, color=COL_BUSINESS_CATEGORY)
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif viz_view == "🧑‍🌾 Marginal Workers":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Marginal Workers by State</span>", unsafe_allow_html=True)
-        marg_state = group_sum(filtered_state_data, COL_STATE_NAME, COL_MARGINAL_WORKERS_TOTAL_PERSONS)
-        fig = px.bar(marg_state, x=COL_STATE_NAME, y=COL_MARGINAL_WORKERS_TOTAL_PERSONS, color=COL_STATE_NAME)
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Marginal Workers by District</span>", unsafe_allow_html=True)
-        marg_district = group_sum(filtered_district_data, COL_STATE_NAME, COL_MARGINAL_WORKERS_TOTAL_PERSONS)
-        fig = px.bar(marg_district, x=COL_STATE_NAME, y=COL_MARGINAL_WORKERS_TOTAL_PERSONS, color=COL_STATE_NAME)
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>📊 Marginal Workers by Business Category</span>", unsafe_allow_html=True)
-        marg_cat = group_sum(filtered_data, COL_BUSINESS_CATEGORY, COL_MARGINAL_WORKERS_TOTAL_PERSONS)
-        fig = px.bar(marg_cat, x=COL_BUSINESS_CATEGORY, y=COL_MARGINAL_WORKERS_TOTAL_PERSONS, color=COL_BUSINESS_CATEGORY)
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif viz_view == "📊 Combined Main vs Marginal":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Main vs Marginal by State</span>", unsafe_allow_html=True)
-        combined_state = group_sum_multi(filtered_state_data, COL_STATE_NAME, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
-        fig = px.bar(combined_state, x=COL_STATE_NAME, y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
-                     labels={COL_MAIN_WORKERS:'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS:'Marginal'})
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Main vs Marginal by District</span>", unsafe_allow_html=True)
-        combined_district = group_sum_multi(filtered_district_data, COL_STATE_NAME, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
-        fig = px.bar(combined_district, x=COL_STATE_NAME, y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
-                     labels={COL_MAIN_WORKERS:'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS:'Marginal'})
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>📊 Main vs Marginal by Business Category</span>", unsafe_allow_html=True)
-        combined_cat = group_sum_multi(filtered_data, COL_BUSINESS_CATEGORY, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
-        fig = px.bar(combined_cat, x=COL_BUSINESS_CATEGORY, y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
-                     labels={COL_MAIN_WORKERS:'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS:'Marginal'})
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif viz_view == "🏞️ Main: Rural/Urban":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Main Workers Rural vs Urban by State</span>", unsafe_allow_html=True)
-        rural_col = 'Main Workers - Rural -  Persons'
-        urban_col = 'Main Workers - Urban -  Persons'
-        main_rural_urban = group_sum_multi(filtered_state_data, COL_STATE_NAME, [rural_col, urban_col])
-        fig = px.bar(main_rural_urban, x=COL_STATE_NAME, y=[rural_col, urban_col], barmode='group',
-                     labels={rural_col:'Rural', urban_col:'Urban'})
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Main Workers Rural vs Urban by District</span>", unsafe_allow_html=True)
-        main_rural_urban_dist = group_sum_multi(filtered_district_data, COL_STATE_NAME, [rural_col, urban_col])
-        fig = px.bar(main_rural_urban_dist, x=COL_STATE_NAME, y=[rural_col, urban_col], barmode='group',
-                     labels={rural_col:'Rural', urban_col:'Urban'})
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif viz_view == "👫 Main: Male vs Female":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Main Workers Male vs Female by State</span>", unsafe_allow_html=True)
-        male_col = COL_MAIN_WORKERS_TOTAL_MALES
-        female_col = COL_MAIN_WORKERS_TOTAL_FEMALES
-        main_mf = group_sum_multi(filtered_state_data, COL_STATE_NAME, [male_col, female_col])
-        fig = px.bar(main_mf, x=COL_STATE_NAME, y=[male_col, female_col], barmode='group',
-                     labels={male_col:'Male', female_col:'Female'})
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Main Workers Male vs Female by District</span>", unsafe_allow_html=True)
-        main_mf_dist = group_sum_multi(filtered_district_data, COL_STATE_NAME, [male_col, female_col])
-        fig = px.bar(main_mf_dist, x=COL_STATE_NAME, y=[male_col, female_col], barmode='group',
-                     labels={male_col:'Male', female_col:'Female'})
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif viz_view == "🏞️ Marginal: Rural/Urban":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Marginal Workers Rural vs Urban by State</span>", unsafe_allow_html=True)
-        marg_rural_col = 'Marginal Workers - Rural -  Persons'
-        marg_urban_col = 'Marginal Workers - Urban -  Persons'
-        marg_rural_urban = group_sum_multi(filtered_state_data, COL_STATE_NAME, [marg_rural_col, marg_urban_col])
-        fig = px.bar(marg_rural_urban, x=COL_STATE_NAME, y=[marg_rural_col, marg_urban_col], barmode='group',
-                     labels={marg_rural_col:'Rural', marg_urban_col:'Urban'})
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Marginal Workers Rural vs Urban by District</span>", unsafe_allow_html=True)
-        marg_rural_urban_dist = group_sum_multi(filtered_district_data, COL_STATE_NAME, [marg_rural_col, marg_urban_col])
-        fig = px.bar(marg_rural_urban_dist, x=COL_STATE_NAME, y=[marg_rural_col, marg_urban_col], barmode='group',
-                     labels={marg_rural_col:'Rural', marg_urban_col:'Urban'})
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif viz_view == "👫 Marginal: Male vs Female":
-        st.markdown("#### <span style='font-size:1.2em'>🏞️ Marginal Workers Male vs Female by State</span>", unsafe_allow_html=True)
-        marg_male_col = COL_MARGINAL_WORKERS_TOTAL_MALES
-        marg_female_col = COL_MARGINAL_WORKERS_TOTAL_FEMALES
-        marg_mf = group_sum_multi(filtered_state_data, COL_STATE_NAME, [marg_male_col, marg_female_col])
-        fig = px.bar(marg_mf, x=COL_STATE_NAME, y=[marg_male_col, marg_female_col], barmode='group',
-                     labels={marg_male_col:'Male', marg_female_col:'Female'})
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("#### <span style='font-size:1.2em'>🏙️ Marginal Workers Male vs Female by District</span>", unsafe_allow_html=True)
-        marg_mf_dist = group_sum_multi(filtered_district_data, COL_STATE_NAME, [marg_male_col, marg_female_col])
-        fig = px.bar(marg_mf_dist, x=COL_STATE_NAME, y=[marg_male_col, marg_female_col], barmode='group',
-                     labels={marg_male_col:'Male', marg_female_col:'Female'})
-        st.plotly_chart(fig, use_container_width=True)
+    if wizard_tab[1].open:
+        charts_stage = profiler.begin('charts', rows=len(filtered_cube))
+        viz_options = [
+            "👷 Main Workers",
+            "🧑‍🌾 Marginal Workers",
+            "📊 Combined Main vs Marginal",
+            "🏞️ Main: Rural/Urban",
+            "👫 Main: Male vs Female",
+            "🏞️ Marginal: Rural/Urban",
+            "👫 Marginal: Male vs Female",
+            "🧭 NIC Drill-down"
+        ]
+        viz_view = st.selectbox(
+            "<span style='font-size:1.1em; font-weight:600;'>Select Visualization View:</span>",
+            viz_options,
+            key="viz_view_select",
+            format_func=lambda x: x,
+            help="Choose a visualization type to explore different aspects of the workforce."
+        )
+        st.markdown("""
+        <style>
+        .stSelectbox > div[data-baseweb="select"] {
+            background: #f8fafc;
+            border-radius: 8px;
+            padding: 0.5em 1em;
+            font-size: 1.1em;
+            font-weight: 600;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.04);
+            margin-bottom: 1.2em;
+        }
+        </style>
+        """, unsafe_allow_html=True)
+
+        # Charts roll up the pre-aggregated cube slices, never the row-level frames
+        group_sum = engine.aggregate
+        group_sum_multi = engine.aggregate
+
+        if viz_view == "👷 Main Workers":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Main Workers by State</span>", unsafe_allow_html=True)
+            main_state = group_sum(state_cube, COL_STATE_NAME, COL_MAIN_WORKERS)
+            fig = cached_figure('main_state', lambda: bar_chart(main_state, x=COL_STATE_NAME, y=COL_MAIN_WORKERS, color=COL_STATE_NAME))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Main Workers by District</span>", unsafe_allow_html=True)
+            main_district = group_sum(district_cube, COL_STATE_NAME, COL_MAIN_WORKERS)
+            fig = cached_figure('main_district', lambda: bar_chart(main_district, x=COL_STATE_NAME, y=COL_MAIN_WORKERS, color=COL_STATE_NAME))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>📊 Main Workers by Business Category</span>", unsafe_allow_html=True)
+            main_cat = group_sum(filtered_cube, COL_BUSINESS_CATEGORY, COL_MAIN_WORKERS)
+            fig = cached_figure('main_cat', lambda: bar_chart(main_cat, x=COL_BUSINESS_CATEGORY, y=COL_MAIN_WORKERS, color=COL_BUSINESS_CATEGORY))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "🧑‍🌾 Marginal Workers":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Marginal Workers by State</span>", unsafe_allow_html=True)
+            marg_state = group_sum(state_cube, COL_STATE_NAME, COL_MARGINAL_WORKERS_TOTAL_PERSONS)
+            fig = cached_figure('marg_state', lambda: bar_chart(marg_state, x=COL_STATE_NAME, y=COL_MARGINAL_WORKERS_TOTAL_PERSONS, color=COL_STATE_NAME))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Marginal Workers by District</span>", unsafe_allow_html=True)
+            marg_district = group_sum(district_cube, COL_STATE_NAME, COL_MARGINAL_WORKERS_TOTAL_PERSONS)
+            fig = cached_figure('marg_district', lambda: bar_chart(marg_district, x=COL_STATE_NAME, y=COL_MARGINAL_WORKERS_TOTAL_PERSONS, color=COL_STATE_NAME))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>📊 Marginal Workers by Business Category</span>", unsafe_allow_html=True)
+            marg_cat = group_sum(filtered_cube, COL_BUSINESS_CATEGORY, COL_MARGINAL_WORKERS_TOTAL_PERSONS)
+            fig = cached_figure('marg_cat', lambda: bar_chart(marg_cat, x=COL_BUSINESS_CATEGORY, y=COL_MARGINAL_WORKERS_TOTAL_PERSONS, color=COL_BUSINESS_CATEGORY))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "📊 Combined Main vs Marginal":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Main vs Marginal by State</span>", unsafe_allow_html=True)
+            combined_state = group_sum_multi(state_cube, COL_STATE_NAME, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
+            fig = cached_figure('combined_state', lambda: bar_chart(combined_state, x=COL_STATE_NAME, y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
+                                                                    labels={COL_MAIN_WORKERS:'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS:'Marginal'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Main vs Marginal by District</span>", unsafe_allow_html=True)
+            combined_district = group_sum_multi(district_cube, COL_STATE_NAME, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
+            fig = cached_figure('combined_district', lambda: bar_chart(combined_district, x=COL_STATE_NAME, y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
+                                                                       labels={COL_MAIN_WORKERS:'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS:'Marginal'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>📊 Main vs Marginal by Business Category</span>", unsafe_allow_html=True)
+            combined_cat = group_sum_multi(filtered_cube, COL_BUSINESS_CATEGORY, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
+            fig = cached_figure('combined_cat', lambda: bar_chart(combined_cat, x=COL_BUSINESS_CATEGORY, y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
+                                                                  labels={COL_MAIN_WORKERS:'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS:'Marginal'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "🏞️ Main: Rural/Urban":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Main Workers Rural vs Urban by State</span>", unsafe_allow_html=True)
+            rural_col = 'Main Workers - Rural -  Persons'
+            urban_col = 'Main Workers - Urban -  Persons'
+            main_rural_urban = group_sum_multi(state_cube, COL_STATE_NAME, [rural_col, urban_col])
+            fig = cached_figure('main_rural_urban', lambda: bar_chart(main_rural_urban, x=COL_STATE_NAME, y=[rural_col, urban_col], barmode='group',
+                                                                      labels={rural_col:'Rural', urban_col:'Urban'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Main Workers Rural vs Urban by District</span>", unsafe_allow_html=True)
+            main_rural_urban_dist = group_sum_multi(district_cube, COL_STATE_NAME, [rural_col, urban_col])
+            fig = cached_figure('main_rural_urban_dist', lambda: bar_chart(main_rural_urban_dist, x=COL_STATE_NAME, y=[rural_col, urban_col], barmode='group',
+                                                                           labels={rural_col:'Rural', urban_col:'Urban'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "👫 Main: Male vs Female":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Main Workers Male vs Female by State</span>", unsafe_allow_html=True)
+            male_col = COL_MAIN_WORKERS_TOTAL_MALES
+            female_col = COL_MAIN_WORKERS_TOTAL_FEMALES
+            main_mf = group_sum_multi(state_cube, COL_STATE_NAME, [male_col, female_col])
+            fig = cached_figure('main_mf', lambda: bar_chart(main_mf, x=COL_STATE_NAME, y=[male_col, female_col], barmode='group',
+                                                             labels={male_col:'Male', female_col:'Female'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Main Workers Male vs Female by District</span>", unsafe_allow_html=True)
+            main_mf_dist = group_sum_multi(district_cube, COL_STATE_NAME, [male_col, female_col])
+            fig = cached_figure('main_mf_dist', lambda: bar_chart(main_mf_dist, x=COL_STATE_NAME, y=[male_col, female_col], barmode='group',
+                                                                  labels={male_col:'Male', female_col:'Female'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "🏞️ Marginal: Rural/Urban":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Marginal Workers Rural vs Urban by State</span>", unsafe_allow_html=True)
+            marg_rural_col = 'Marginal Workers - Rural -  Persons'
+            marg_urban_col = 'Marginal Workers - Urban -  Persons'
+            marg_rural_urban = group_sum_multi(state_cube, COL_STATE_NAME, [marg_rural_col, marg_urban_col])
+            fig = cached_figure('marg_rural_urban', lambda: bar_chart(marg_rural_urban, x=COL_STATE_NAME, y=[marg_rural_col, marg_urban_col], barmode='group',
+                                                                      labels={marg_rural_col:'Rural', marg_urban_col:'Urban'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Marginal Workers Rural vs Urban by District</span>", unsafe_allow_html=True)
+            marg_rural_urban_dist = group_sum_multi(district_cube, COL_STATE_NAME, [marg_rural_col, marg_urban_col])
+            fig = cached_figure('marg_rural_urban_dist', lambda: bar_chart(marg_rural_urban_dist, x=COL_STATE_NAME, y=[marg_rural_col, marg_urban_col], barmode='group',
+                                                                           labels={marg_rural_col:'Rural', marg_urban_col:'Urban'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "👫 Marginal: Male vs Female":
+            st.markdown("#### <span style='font-size:1.2em'>🏞️ Marginal Workers Male vs Female by State</span>", unsafe_allow_html=True)
+            marg_male_col = COL_MARGINAL_WORKERS_TOTAL_MALES
+            marg_female_col = COL_MARGINAL_WORKERS_TOTAL_FEMALES
+            marg_mf = group_sum_multi(state_cube, COL_STATE_NAME, [marg_male_col, marg_female_col])
+            fig = cached_figure('marg_mf', lambda: bar_chart(marg_mf, x=COL_STATE_NAME, y=[marg_male_col, marg_female_col], barmode='group',
+                                                             labels={marg_male_col:'Male', marg_female_col:'Female'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("#### <span style='font-size:1.2em'>🏙️ Marginal Workers Male vs Female by District</span>", unsafe_allow_html=True)
+            marg_mf_dist = group_sum_multi(district_cube, COL_STATE_NAME, [marg_male_col, marg_female_col])
+            fig = cached_figure('marg_mf_dist', lambda: bar_chart(marg_mf_dist, x=COL_STATE_NAME, y=[marg_male_col, marg_female_col], barmode='group',
+                                                                  labels={marg_male_col:'Male', marg_female_col:'Female'}))
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif viz_view == "🧭 NIC Drill-down":
+            st.markdown("#### <span style='font-size:1.2em'>🧭 Workers by NIC Division, Group and Class</span>", unsafe_allow_html=True)
+            nic_index = census.nic_index()
+            geo_col, division_col, group_col = st.columns(3)
+            nic_geo = geo_col.radio("Rows", ["States", "Districts"], horizontal=True, key='nic_geo')
+            division = division_col.selectbox(
+                "Division", [None] + list(nic_index['divisions']), key='nic_division',
+                format_func=lambda code: "All divisions" if code is None else utils.nic_label('Division', code)
+            )
+            # One group dropdown per division, so a group of another division is never carried over
+            group = group_col.selectbox(
+                "Group", [None] + nic_index['divisions'].get(division, []), key=f'nic_group_{division}', disabled=division is None,
+                format_func=lambda code: "All groups" if code is None else utils.nic_label('Group', code)
+            )
+            if division is None:
+                nic_level, nic_parent = 'Division', None
+            elif group is None:
+                nic_level, nic_parent = 'Group', division
+            else:
+                nic_level, nic_parent = 'Class', group
+            nic_rows = selection['state_rows'] if nic_geo == "States" else selection['district_rows']
+            # Codes of the selected rows are sorted once per selection; every drill-down is then a range lookup
+            nic_sorted = utils.filter_cache.get_or_build(
+                rows_key + ('nic_sorted', nic_geo), lambda: utils.nic_sorted_positions(nic_rows[COL_NIC_CODE])
+            )
+            nic_summary = engine.nic_drilldown(nic_rows, nic_sorted, nic_index, nic_level, nic_parent, [COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS])
+            fig = cached_figure(('nic_drilldown', nic_geo, nic_level, nic_parent), lambda: bar_chart(
+                nic_summary, x='NIC', y=[COL_MAIN_WORKERS, COL_MARGINAL_WORKERS_TOTAL_PERSONS], barmode='group',
+                labels={'NIC': f"NIC {nic_level}", 'value': 'Workers', COL_MAIN_WORKERS: 'Main', COL_MARGINAL_WORKERS_TOTAL_PERSONS: 'Marginal'}
+            ))
+            st.plotly_chart(fig, use_container_width=True)
+        profiler.end(charts_stage)
 
 # --- Tab 3: Machine Learning ---
 with wizard_tab[2]:
-	st.markdown("Use the tabs below to explore clustering and classification models. Hover over chart elements for details.")
-	from sklearn.cluster import KMeans
-	from sklearn.ensemble import RandomForestClassifier
-	from sklearn.model_selection import train_test_split
-	from sklearn.metrics import classification_report, accuracy_score
-	import numpy as np
-	ml_tab = st.tabs(["🔗 Clustering (KMeans)", "🧮 Classification (Random Forest)"])
-	with ml_tab[0]:
-		st.subheader("🔗 KMeans Clustering: Districts by Worker Composition")
-		cluster_df = filtered_data.copy()
-		cluster_features = [
-            'Main Workers - Total -  Persons',
-            COL_MARGINAL_WORKERS_TOTAL_PERSONS,
-            COL_MAIN_WORKERS_TOTAL_MALES,
-            COL_MAIN_WORKERS_TOTAL_FEMALES,
-            COL_MARGINAL_WORKERS_TOTAL_MALES,
-            COL_MARGINAL_WORKERS_TOTAL_FEMALES
-        ]
-		available_features = [col for col in cluster_features if col in cluster_df.columns]
-		if len(available_features) >= 2:
-			if 'India/States' in cluster_df.columns:
-				group_df = cluster_df.groupby('India/States')[available_features].sum().dropna()
-				n_clusters = st.slider("Number of clusters", 2, 8, 3)
-				kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-				clusters = kmeans.fit_predict(group_df)
-				group_df['Cluster'] = clusters
-				st.write("Clustered Districts/States:")
-				st.dataframe(group_df.reset_index())
-				fig = px.scatter_matrix(
-					group_df.reset_index(),
-					dimensions=available_features,
-					color='Cluster',
-					title="Clusters by Worker Composition"
-				)
-				st.plotly_chart(fig, use_container_width=True)
-			else:
-				st.warning("'India/States' column not found for grouping.")
-		else:
-			st.warning("Not enough features available for clustering.")
-	with ml_tab[1]:
-		st.subheader("🧮 Random Forest Classification: Predict Business Category")
-		class_df = filtered_data.copy()
-		class_features = [
-            'Main Workers - Total -  Persons',
-            COL_MARGINAL_WORKERS_TOTAL_PERSONS,
-            COL_MAIN_WORKERS_TOTAL_MALES,
-            COL_MAIN_WORKERS_TOTAL_FEMALES,
-            COL_MARGINAL_WORKERS_TOTAL_MALES,
-            COL_MARGINAL_WORKERS_TOTAL_FEMALES
-        ]
-		available_class_features = [col for col in class_features if col in class_df.columns]
-		if COL_BUSINESS_CATEGORY in class_df.columns and len(available_class_features) >= 2:
-			class_df = class_df.dropna(subset=[COL_BUSINESS_CATEGORY])
+	if wizard_tab[2].open:
+		st.markdown("Use the tabs below to explore clustering and classification models. Hover over chart elements for details.")
+		import plotly.express as px
+		ml_tab = st.tabs(["🔗 Clustering (KMeans)", "🧮 Classification (Random Forest)"], key='ml_tab', on_change='rerun')
+		with ml_tab[0]:
+			if ml_tab[0].open:
+				st.subheader("🔗 KMeans Clustering: Districts by Worker Composition")
+				cluster_df = filtered_data.copy()
+				cluster_features = [
+		            'Main Workers - Total -  Persons',
+		            COL_MARGINAL_WORKERS_TOTAL_PERSONS,
+		            COL_MAIN_WORKERS_TOTAL_MALES,
+		            COL_MAIN_WORKERS_TOTAL_FEMALES,
+		            COL_MARGINAL_WORKERS_TOTAL_MALES,
+		            COL_MARGINAL_WORKERS_TOTAL_FEMALES
+		        ]
+				available_features = [col for col in cluster_features if col in cluster_df.columns]
+				if len(available_features) >= 2:
+					if 'India/States' in cluster_df.columns:
+						group_df = cluster_df.groupby('India/States', observed=True)[available_features].sum().dropna()
+						n_clusters = st.slider("Number of clusters", 2, 8, 3)
+						scale_features = st.checkbox("Scale features", value=False, help="Standardize each worker count before clustering.")
+						# Every slider value is clustered in one cached run, so moving the slider only looks up labels
+						with profiler.stage('clustering', rows=len(group_df)):
+							cluster_sweep = ml.kmeans_sweep(group_df, range(2, 9), cache_dir=MODEL_CACHE_DIR, scale=scale_features, random_state=42, n_init=10)
+						if n_clusters in cluster_sweep:
+							group_df['Cluster'] = cluster_sweep[n_clusters]
+							st.write("Clustered Districts/States:")
+							st.dataframe(group_df.reset_index())
+							plot_df = group_df.reset_index()
+							if len(plot_df) > SCATTER_MATRIX_MAX_POINTS:
+								plot_df = plot_df.sample(SCATTER_MATRIX_MAX_POINTS, random_state=42)
+								st.caption(f"Scatter matrix shows a random sample of {SCATTER_MATRIX_MAX_POINTS:,} of {len(group_df):,} districts/states.")
+							fig = cached_figure(('scatter_matrix', n_clusters, scale_features), lambda: px.scatter_matrix(
+								plot_df,
+								dimensions=available_features,
+								color='Cluster',
+								title="Clusters by Worker Composition"
+							))
+							st.plotly_chart(fig, use_container_width=True)
+						else:
+							st.warning(f"Not enough districts/states selected for {n_clusters} clusters.")
+					else:
+						st.warning("'India/States' column not found for grouping.")
+				else:
+					st.warning("Not enough features available for clustering.")
+		with ml_tab[1]:
+			if ml_tab[1].open:
+				from sklearn.model_selection import train_test_split
+				from sklearn.metrics import classification_report, accuracy_score
+				st.subheader("🧮 Random Forest Classification: Predict Business Category")
+				class_df = filtered_data.copy()
+				class_features = [
+		            'Main Workers - Total -  Persons',
+		            COL_MARGINAL_WORKERS_TOTAL_PERSONS,
+		            COL_MAIN_WORKERS_TOTAL_MALES,
+		            COL_MAIN_WORKERS_TOTAL_FEMALES,
+		            COL_MARGINAL_WORKERS_TOTAL_MALES,
+		            COL_MARGINAL_WORKERS_TOTAL_FEMALES
+		        ]
+				available_class_features = [col for col in class_features if col in class_df.columns]
+				if COL_BUSINESS_CATEGORY in class_df.columns and len(available_class_features) >= 2:
+					class_df = class_df.dropna(subset=[COL_BUSINESS_CATEGORY])
 			
-			X = class_df[available_class_features].fillna(0)
-			y = class_df[COL_BUSINESS_CATEGORY]
-			if y.nunique() > 1:
-				X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
-				clf = RandomForestClassifier( 					
-						n_estimators=600,
-						max_depth=None,
-						min_samples_leaf=2,
-						max_features='sqrt',
-						n_jobs=-1,
-						random_state=42,
-						class_weight='balanced'  # helpful for imbalance
-				)
-				clf.fit(X_train, y_train)
-				y_pred = clf.predict(X_test)
-				acc = accuracy_score(y_test, y_pred)
-				st.write(f"**Test Accuracy:** {acc:.2f}")
-				st.text("Classification Report:")
-				st.text(classification_report(y_test, y_pred))
-				importances = clf.feature_importances_
-				feat_imp_df = pd.DataFrame({'Feature': available_class_features, 'Importance': importances})
-				fig_imp = px.bar(feat_imp_df.sort_values('Importance', ascending=False), x='Importance', y='Feature', orientation='h', title="Feature Importances")
-				st.plotly_chart(fig_imp, use_container_width=True)
-			else:
-				st.warning("Not enough classes in Business Category for classification.")
-		else:
-			st.warning("Not enough features or target for classification.")
+					X = class_df[available_class_features].fillna(0)
+					y = class_df[COL_BUSINESS_CATEGORY]
+					if y.nunique() > 1:
+						X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
+						rf_params = dict(
+								n_estimators=600,
+								max_depth=None,
+								min_samples_leaf=2,
+								max_features='sqrt',
+								n_jobs=-1,
+								random_state=42,
+								class_weight='balanced'  # helpful for imbalance
+						)
+						# Training runs on a background thread; the page keeps showing the last finished model until it is ready.
+						# Jobs are shared by sessions training the same forest, so each session only withdraws its own interest.
+						forest_stage = profiler.begin('random_forest', rows=len(X_train))
+						session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+						previous_job = st.session_state.get('forest_job')
+						training_failed = False
+						clf = ml.cached_random_forest(X_train, y_train, cache_dir=MODEL_CACHE_DIR, **rf_params)
+						if clf is None:
+							job_id = ml.submit_random_forest(X_train, y_train, cache_dir=MODEL_CACHE_DIR, subscriber=session_id, **rf_params)
+							if previous_job is not None and previous_job != job_id:
+								ml.cancel_job(previous_job, session_id)
+							st.session_state['forest_job'] = job_id
+							try:
+								clf = ml.job_result(job_id)
+							except Exception as e:
+								training_failed = True
+								st.error(f"Random Forest training failed: {e}")
+						elif previous_job is not None:
+							ml.cancel_job(previous_job, session_id)
+							del st.session_state['forest_job']
+						if clf is not None:
+							y_pred = clf.predict(X_test)
+							st.session_state['forest_results'] = {
+								'accuracy': accuracy_score(y_test, y_pred),
+								'report': classification_report(y_test, y_pred),
+								'importances': pd.DataFrame({'Feature': available_class_features, 'Importance': clf.feature_importances_}),
+							}
+						elif not training_failed:
+							@st.fragment(run_every=1)
+							def forest_progress():
+								# 'missing': the forest was trained and cached (or the job was dropped); a rerun picks it up or resubmits
+								state, elapsed = ml.job_status(st.session_state['forest_job'])
+								if state in ('done', 'missing'):
+									st.rerun()
+								st.info(f"Random Forest is {'training' if state == 'running' else 'queued'} in the background ({elapsed:.0f}s). "
+									+ ("Showing the previous model until it finishes." if 'forest_results' in st.session_state else ""))
+							forest_progress()
+						profiler.end(forest_stage)
+						results = st.session_state.get('forest_results')
+						if results is not None:
+							st.write(f"**Test Accuracy:** {results['accuracy']:.2f}")
+							st.text("Classification Report:")
+							st.text(results['report'])
+							feat_imp_df = results['importances']
+							fig_imp = px.bar(feat_imp_df.sort_values('Importance', ascending=False), x='Importance', y='Feature', orientation='h', title="Feature Importances")
+							st.plotly_chart(fig_imp, use_container_width=True)
+					else:
+						st.warning("Not enough classes in Business Category for classification.")
+				else:
+					st.warning("Not enough features or target for classification.")
+
+# --- Profiling panel ---
+if st.sidebar.toggle("🛠️ Profiling panel", key='profiling_panel', help="Per-stage timings of this run, also appended to profile_log.jsonl in the data folder."):
+	profile_df = pd.DataFrame(profiler.records)
+	st.sidebar.dataframe(
+		profile_df[['stage', 'wall_ms', 'rows', 'mem_delta_mb', 'cache_hits', 'cache_misses']],
+		hide_index=True, use_container_width=True
+	)
+	st.sidebar.caption(f"Run {profiler.run_id}: {profile_df['wall_ms'].sum():,.1f} ms across {len(profile_df)} stages.")
+	if engine.QUERY_BACKEND != 'sql':
+		# Breakdown of the load stage: how each CSV's partition was last built, from its snapshot or the CSV
+		st.sidebar.markdown("**Ingestion per file**")
+		st.sidebar.dataframe(data_engine.ingest_timings(data_version), hide_index=True, use_container_width=True)
+	try:
+		profiler.append_log(PROFILE_LOG)
+	except OSError as e:
+		st.sidebar.warning(f"Could not write the profiling log: {e}")
 
 # --- Footer ---
 st.markdown("""
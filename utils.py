@@ -1,20 +1,57 @@
 # utils.py
-def filter_df(df, state=None, worker_type=None, sex=None, category=None):
+import bisect
+import codecs
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pandas.errors
+from pandas.api.types import union_categoricals
+
+try:
+	import pyarrow as pa
+	import pyarrow.feather as feather
+except ImportError:
+	pa = feather = None
+
+def filter_mask(df, state=None, worker_type=None, sex=None, category=None):
 	"""
-	Applies multi-select filters to the DataFrame.
+	Combines the multi-select filters into one boolean mask over the rows of df.
 	"""
-	df = df.copy()
+	mask = np.ones(len(df), dtype=bool)
 	if state is not None and len(state) > 0:
-		df = df[df['state'].isin(state)]
+		mask &= df['state'].isin(state).to_numpy()
 	if worker_type is not None and len(worker_type) > 0 and 'worker_type' in df.columns:
-		df = df[df['worker_type'].isin(worker_type)]
+		mask &= df['worker_type'].isin(worker_type).to_numpy()
 	if sex is not None and len(sex) > 0 and 'sex' in df.columns:
-		df = df[df['sex'].isin(sex)]
+		mask &= df['sex'].isin(sex).to_numpy()
 	if category is not None and len(category) > 0 and 'category' in df.columns:
-		df = df[df['category'].isin(category)]
-	return df
+		mask &= df['category'].isin(category).to_numpy()
+	return mask
+
+def filter_rows(df, state=None, worker_type=None, sex=None, category=None):
+	"""
+	Returns the positions of the rows matching the filters, for use with df.iloc / df.take.
+	"""
+	return np.flatnonzero(filter_mask(df, state, worker_type, sex, category))
+
+def filter_df(df, state=None, worker_type=None, sex=None, category=None):
+	"""
+	Applies multi-select filters to the DataFrame.
+	The filters are combined into one mask first, so only the final selection is materialized.
+	"""
+	return df[filter_mask(df, state, worker_type, sex, category)]
 
 	
+
 categories = {
     'Retail': [
         'Non-specialized wholesale trade',
@@ -298,8 +335,746 @@ categories = {
         'Service activities incidental to water transportation'
     ]
 }
-def map_category(activity):
+def normalize_activity(activity):
+	"""Lowercases, collapses whitespace and drops trailing punctuation left by truncated NIC names."""
+	activity = ' '.join(str(activity).replace('’', "'").lower().split())
+	return activity.rstrip(' ,;:.')
+
+def _build_activity_indexes():
+	"""Builds exact, normalized and sorted-prefix indexes over categories (first category wins)."""
+	exact = {}
+	normalized = {}
 	for category, activities in categories.items():
-		if activity in activities:
+		for activity in activities:
+			exact.setdefault(activity, category)
+			normalized.setdefault(normalize_activity(activity), category)
+	return exact, normalized, sorted(normalized)
+
+_activity_index, _normalized_activity_index, _sorted_activity_keys = _build_activity_indexes()
+# Prefixes shorter than this are never matched
+MIN_PREFIX_LENGTH = 10
+
+def _prefix_category(prefix):
+	"""
+	Category of every known name starting with the normalized prefix, or None when the prefix is shorter
+	than MIN_PREFIX_LENGTH, starts no known name or starts names of different categories.
+	"""
+	if len(prefix) < MIN_PREFIX_LENGTH:
+		return None
+	start = bisect.bisect_left(_sorted_activity_keys, prefix)
+	stop = start
+	while stop < len(_sorted_activity_keys) and _sorted_activity_keys[stop].startswith(prefix):
+		stop += 1
+	matches = {_normalized_activity_index[name] for name in _sorted_activity_keys[start:stop]}
+	return matches.pop() if len(matches) == 1 else None
+
+def map_category(activity):
+	"""
+	Returns the category of an activity name, or 'Other'.
+	Tries an exact match, then a normalized match, then the longest known name the activity starts with
+	(for entries stored truncated), then the known names that start with the activity (for truncated input).
+	Both prefix matches only count when the prefix has at least MIN_PREFIX_LENGTH characters and every
+	known name it starts maps to the same category (see _prefix_category).
+	"""
+	category = _activity_index.get(activity)
+	if category is not None:
+		return category
+	key = normalize_activity(activity)
+	if not key:
+		return 'Other'
+	category = _normalized_activity_index.get(key)
+	if category is not None:
+		return category
+	words = key.split(' ')
+	for n in range(len(words) - 1, 0, -1):
+		prefix = normalize_activity(' '.join(words[:n]))
+		if prefix in _normalized_activity_index:
+			category = _prefix_category(prefix)
+			if category is not None:
+				return category
+	return _prefix_category(key) or 'Other'
+
+def map_categories(activities):
+	"""Vectorized map_category for a Series: each distinct activity is looked up once."""
+	codes, uniques = pd.factorize(activities)
+	labels = np.array([map_category(activity) for activity in uniques] + ['Other'], dtype=object)
+	return pd.Series(labels[codes], index=activities.index, name=activities.name)
+
+
+# --- Business category classification ---
+# Categorize business activities using NLP keywords; categories are checked in order and the first match wins
+category_keywords = {
+    'Retail': ['stalls', 'markets', 'via', 'or', 'food', 'beverages', 'tobacco', 'motor', 'non-specialized', 'household'],
+    'Poultry': ['raising', 'poultry'],
+    'Agriculture': ['growing', 'crops', 'fruits', 'crop', 'forestry', 'support', 'rice', 'non-perennial', 'perennial', 'post-harvest'],
+    'Manufacturing': ['machinery', 'vehicles', 'metal', 'apparel', 'basic', 'motor', 'chemical', 'paper', 'rubber', 'animal'],
+    'Education': ['education', 'secondary', 'cultural', 'educational', 'support', 'general', 'higher', 'primary', 'regulation', 'providing'],
+    'Healthcare': ['health', 'mental', 'transportation', 'human', 'residential', 'care', 'retardation', 'hospital', 'medical', 'dental']
+}
+# One alternation per category, compiled once
+category_patterns = {category: re.compile('|'.join(keywords)) for category, keywords in category_keywords.items()}
+
+def categorize_activity(nic_name):
+	"""Classifies a single NIC name. Reference implementation for categorize_activities."""
+	nic_name_lower = str(nic_name).lower()
+	for category, keywords in category_keywords.items():
+		if any(re.search(keyword, nic_name_lower) for keyword in keywords):
 			return category
-	return 'Other'
\ No newline at end of file
+	return 'Other'
+
+def categorize_activities(nic_names):
+	"""
+	Vectorized categorize_activity for a Series of NIC names.
+	Each distinct name is classified once and the labels are mapped back through the factorized codes.
+	"""
+	codes, uniques = pd.factorize(nic_names.astype(str))
+	lowered = pd.Series(uniques, dtype=object).str.lower()
+	labels = np.full(len(uniques), 'Other', dtype=object)
+	unassigned = np.ones(len(uniques), dtype=bool)
+	for category, pattern in category_patterns.items():
+		hit = unassigned & lowered.str.contains(pattern).to_numpy(dtype=bool)
+		labels[hit] = category
+		unassigned &= ~hit
+	return pd.Series(labels[codes], index=nic_names.index, name=nic_names.name)
+
+# --- NIC hierarchy ---
+# NIC 2008 codes nest by digits: class 0111 lies in group 011 and division 01. As integers a group or
+# division is a contiguous range of class codes, and class codes roll up to it by floor division.
+# Level -> (class codes per unit, zero-padded width)
+NIC_LEVELS = {'Division': (100, 2), 'Group': (10, 3), 'Class': (1, 4)}
+
+def parse_nic_codes(values):
+	"""
+	Integer codes of cleaned, zero-padded NIC strings ('0111' -> 111). Blank, non-numeric, fractional
+	and out-of-range values (outside 0-9999, which int16 would wrap) become -1.
+	"""
+	codes = pd.to_numeric(values, errors='coerce')
+	valid = codes.between(0, 9999) & (codes % 1 == 0)
+	return codes.where(valid, -1).astype('int16').to_numpy()
+
+def nic_label(level, code):
+	"""Zero-padded display form of an integer code, e.g. ('Group', 11) -> '011'."""
+	return str(int(code)).zfill(NIC_LEVELS[level][1])
+
+def nic_code_range(level, code):
+	"""Inclusive (low, high) range of the class codes under a division, group or class code."""
+	step = NIC_LEVELS[level][0]
+	return code * step, code * step + step - 1
+
+def build_nic_index(codes, names):
+	"""
+	Hierarchy of the class codes present, with each class's first NIC name:
+	{'divisions': {division: [groups]}, 'groups': {group: [classes]}, 'names': {class: name}}, lists sorted.
+	Unparsed (negative) codes are left out.
+	"""
+	pairs = pd.DataFrame({'code': np.asarray(codes), 'name': np.asarray(names, dtype=object)})
+	pairs = pairs[pairs['code'] >= 0].drop_duplicates('code').sort_values('code', kind='stable')
+	divisions, groups, class_names = {}, {}, {}
+	for code, name in pairs.itertuples(index=False):
+		code = int(code)
+		group = code // NIC_LEVELS['Group'][0]
+		if group not in groups:
+			divisions.setdefault(code // NIC_LEVELS['Division'][0], []).append(group)
+		groups.setdefault(group, []).append(code)
+		class_names[code] = str(name)
+	return {'divisions': divisions, 'groups': groups, 'names': class_names}
+
+def nic_sorted_positions(codes):
+	"""(row positions that sort codes, the sorted codes): the lookup structure for nic_range_positions."""
+	codes = np.asarray(codes)
+	order = np.argsort(codes, kind='stable')
+	return order, codes[order]
+
+def nic_range_positions(sorted_positions, low, high):
+	"""Row positions, in row order, whose code lies in [low, high]; two binary searches on the sorted codes."""
+	order, sorted_codes = sorted_positions
+	start, stop = np.searchsorted(sorted_codes, [low, high + 1])
+	return np.sort(order[start:stop])
+
+def nic_rollup(df, code_col, level, measures):
+	"""Sums measures per division, group or class of the integer codes in code_col; rows with unparsed codes are skipped."""
+	codes = df[code_col].to_numpy()
+	keep = codes >= 0
+	# Codes are at most four digits, so one bincount per measure replaces a groupby
+	keys = codes[keep] // NIC_LEVELS[level][0]
+	present = np.flatnonzero(np.bincount(keys))
+	summary = {code_col: present}
+	for col in measures:
+		summary[col] = np.bincount(keys, weights=df[col].to_numpy()[keep])[present].astype('int64')
+	return pd.DataFrame(summary)
+
+# --- Census frame schema ---
+def apply_census_schema(df, category_columns, count_columns):
+	"""
+	Stores text dimensions as categoricals and worker counts as the smallest unsigned integer type that fits.
+	Missing or non-numeric counts become 0. Columns not present in df are ignored.
+	"""
+	df = df.copy()
+	for col in count_columns:
+		if col in df.columns:
+			counts = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int64')
+			df[col] = pd.to_numeric(counts, downcast='unsigned' if (counts >= 0).all() else 'integer')
+	for col in category_columns:
+		if col in df.columns:
+			df[col] = df[col].astype('category')
+	return df
+
+# --- Cleaning ---
+def clean_census_data(data, category_columns, count_columns, timings=None):
+	"""
+	Cleans the merged census frame, assigns business categories and drops the 'Total' row.
+	The result is stored with apply_census_schema(category_columns, count_columns).
+	If a timings dict is given, the seconds spent categorizing are added to timings['categorize'].
+	"""
+	# Clean the data
+	cleaned_data = data.dropna(how='all')
+	cleaned_data.columns = [col.strip() for col in cleaned_data.columns]
+
+	# Remove special characters and trim spaces from key columns
+	for col in ['State Code', 'District Code', 'India/States', 'Division', 'Group', 'Class']:
+		if col in cleaned_data.columns:
+			cleaned_data[col] = cleaned_data[col].astype(str).str.replace(r'[^\w\s-]', '', regex=True).str.strip()
+
+	# Clean the columns by removing backticks, trimming spaces, and zero-padding
+	for col, (step, width) in NIC_LEVELS.items():
+		cleaned_data[col] = cleaned_data[col].astype(str).str.replace('`', '').str.strip().str.zfill(width)
+	# Parse the hierarchy once; the integer class code carries its group and division (see NIC_LEVELS)
+	division, group, nic_class = (parse_nic_codes(cleaned_data[col]) for col in NIC_LEVELS)
+	cleaned_data['NIC Code'] = nic_class
+
+	cleaned_data['NIC Name'] = cleaned_data['NIC Name'].astype(str).str.strip()
+
+	# Assign business category before filtering out 'Total' row
+	start = time.perf_counter()
+	cleaned_data['Business Category'] = categorize_activities(cleaned_data['NIC Name'])
+	if timings is not None:
+		timings['categorize'] = timings.get('categorize', 0) + time.perf_counter() - start
+
+	# Remove the 'Total' row from the cleaned data for all downstream analysis
+	base = cleaned_data[~(
+		(division == 0) & (group == 0) & (nic_class == 0) &
+		(cleaned_data['NIC Name'].str.lower() == 'total').to_numpy()
+	)]
+	return apply_census_schema(base, category_columns, count_columns)
+
+# --- Aggregate cube ---
+def geo_levels(names):
+	"""Labels each India/States value 'STATE', 'DISTRICT' or '' from its prefix, as a categorical."""
+	upper = names.astype(str).str.upper()
+	levels = np.select(
+		[upper.str.startswith('STATE').to_numpy(dtype=bool), upper.str.startswith('DISTRICT').to_numpy(dtype=bool)],
+		['STATE', 'DISTRICT'], ''
+	)
+	return pd.Categorical(levels, categories=['STATE', 'DISTRICT', ''])
+
+def build_cube(df, dims, measures):
+	"""Sums measures over every observed combination of dims."""
+	return df.groupby(dims, observed=True)[measures].sum().reset_index()
+
+def cube_slice(cube, selections):
+	"""Returns the cube rows whose dimension values are in the selected lists ({dim: values})."""
+	mask = np.ones(len(cube), dtype=bool)
+	for dim, values in selections.items():
+		mask &= cube[dim].isin(values).to_numpy()
+	return cube[mask]
+
+def cube_rollup(cube, by, measures):
+	"""Rolls a cube slice up to the by dimension(s)."""
+	return cube.groupby(by, observed=True)[measures].sum().reset_index()
+
+def concat_categorical(frames):
+	"""
+	Concatenates frames on the union of their columns (in order of first appearance), filling a column
+	missing from a frame with NA. Columns that are categorical in every frame having them stay categorical
+	(pd.concat falls back to object when the categories differ); differing categories are merged and sorted.
+	"""
+	names = list(dict.fromkeys(col for frame in frames for col in frame.columns))
+	columns = {}
+	for col in names:
+		present = [frame[col] for frame in frames if col in frame.columns]
+		categorical = all(isinstance(part.dtype, pd.CategoricalDtype) for part in present)
+		# NA filler for frames without the column, categorical (with the first frame's categories) if the column is
+		fill_dtype = present[0].dtype if categorical else object
+		parts = [frame[col] if col in frame.columns else pd.Series([None] * len(frame), dtype=fill_dtype) for frame in frames]
+		if categorical and any(part.dtype != parts[0].dtype for part in parts):
+			columns[col] = union_categoricals(parts, sort_categories=True, ignore_order=True)
+		else:
+			columns[col] = pd.concat(parts, ignore_index=True)
+	return pd.DataFrame(columns)
+
+# --- Selection caches ---
+# Hits and misses of every cache in this module, per thread (each Streamlit session reruns on its own thread)
+_cache_counts = threading.local()
+
+def count_cache(hit):
+	"""Counts one cache lookup for the current thread."""
+	attr = 'hits' if hit else 'misses'
+	setattr(_cache_counts, attr, getattr(_cache_counts, attr, 0) + 1)
+
+def cache_counts():
+	"""(hits, misses) counted on the current thread so far."""
+	return getattr(_cache_counts, 'hits', 0), getattr(_cache_counts, 'misses', 0)
+
+class LRUCache:
+	"""
+	Least-recently-used cache bounded by entry count and approximate memory footprint.
+	Shared by all sessions in the process, so get_or_build is guarded by a lock.
+	"""
+	def __init__(self, max_entries=256, max_bytes=512 * 1024 ** 2):
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self._entries = OrderedDict()
+		self._nbytes = 0
+		self._lock = threading.Lock()
+
+	def get_or_build(self, key, build):
+		"""Returns the cached value for key, calling build() and storing its result on a miss."""
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				count_cache(hit=True)
+				return self._entries[key][0]
+		count_cache(hit=False)
+		value = build()
+		size = approx_nbytes(value)
+		with self._lock:
+			if key in self._entries:
+				self._nbytes -= self._entries.pop(key)[1]
+			self._entries[key] = (value, size)
+			self._nbytes += size
+			while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._nbytes > self.max_bytes):
+				self._nbytes -= self._entries.popitem(last=False)[1][1]
+		return value
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._nbytes = 0
+
+def approx_nbytes(value):
+	"""Approximate memory held by a cached value (frames, arrays and containers of them)."""
+	if isinstance(value, (pd.DataFrame, pd.Series)):
+		usage = value.memory_usage(index=True)
+		return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+	if isinstance(value, (np.ndarray, pd.Categorical)):
+		return int(value.nbytes)
+	if isinstance(value, (tuple, list)):
+		return sys.getsizeof(value) + sum(approx_nbytes(item) for item in value)
+	if isinstance(value, dict):
+		return sys.getsizeof(value) + sum(approx_nbytes(item) for item in value.values())
+	return sys.getsizeof(value)
+
+# Filter results, categories and Quick Stats keyed on (data version, canonical selections)
+filter_cache = LRUCache()
+# Plotly figures keyed on (data version, canonical selections, chart view); figures are not sized, so only counted
+figure_cache = LRUCache(max_entries=64)
+
+def selection_key(*selections):
+	"""Canonical hashable form of multiselect values, independent of selection order."""
+	return tuple(tuple(sorted(str(value) for value in values)) for values in selections)
+
+def worker_totals(df, count_columns):
+	"""
+	Sums every count column in one vectorized pass over the numeric block.
+	Returns {column: int} in count_columns order; columns missing from df count as 0.
+	"""
+	present = [col for col in count_columns if col in df.columns]
+	sums = df[present].to_numpy(dtype='int64').sum(axis=0) if present else []
+	totals = dict.fromkeys(count_columns, 0)
+	totals.update(zip(present, (int(total) for total in sums)))
+	return totals
+
+def cached_worker_totals(key, df, count_columns):
+	"""worker_totals(df, count_columns), reused while key (data version + selection) is unchanged."""
+	return filter_cache.get_or_build(('stats',) + key, lambda: worker_totals(df, count_columns))
+
+# --- Table paging ---
+def search_positions(df, text):
+	"""
+	Row positions of df where any text column contains text (case-insensitive).
+	Categorical columns are searched on their categories and matched back through the codes,
+	so the cost depends on the number of distinct values rather than rows.
+	"""
+	text = text.strip().lower()
+	if not text:
+		return np.arange(len(df))
+	mask = np.zeros(len(df), dtype=bool)
+	for col in df.columns:
+		values = df[col]
+		if isinstance(values.dtype, pd.CategoricalDtype):
+			hits = np.flatnonzero(values.cat.categories.astype(str).str.lower().str.contains(text, regex=False))
+			if len(hits):
+				mask |= np.isin(values.cat.codes.to_numpy(), hits)
+		elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+			mask |= values.astype(str).str.lower().str.contains(text, regex=False).to_numpy()
+	return np.flatnonzero(mask)
+
+def sort_positions(df, column, ascending=True):
+	"""Row positions of df in stable sort order of column, missing values last."""
+	values = df[column].reset_index(drop=True)
+	return values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+def table_positions(order, matches):
+	"""Positions from order (a sort) that are also in matches (a search), keeping the sort order."""
+	keep = np.zeros(len(order), dtype=bool)
+	keep[matches] = True
+	return order[keep[order]]
+
+def table_page(df, positions, page, page_size, columns=None):
+	"""Rows of df for one 1-based page of positions, limited to columns."""
+	start = (page - 1) * page_size
+	rows = df.iloc[positions[start:start + page_size]]
+	return rows[columns] if columns is not None else rows
+
+# --- Geography index ---
+def build_geo_index(df, code_col, name_col):
+	"""
+	Indexes the geography of df once: state names, state name -> codes, code -> names and
+	sorted row positions per (code, name). Names keep the order of their first row.
+	"""
+	return _geo_index(df.groupby([code_col, name_col], observed=True, sort=False).indices)
+
+def merge_geo_indexes(indexes, row_counts):
+	"""
+	Geography index of the row-wise concatenation of several frames, built from
+	their own indexes and row counts without rescanning any frame.
+	"""
+	pair_parts = {}
+	offset = 0
+	for geo_index, rows in zip(indexes, row_counts):
+		for pair, positions in geo_index['pair_rows'].items():
+			pair_parts.setdefault(pair, []).append(positions + offset)
+		offset += rows
+	return _geo_index({pair: np.concatenate(parts) for pair, parts in pair_parts.items()})
+
+def _geo_index(pair_rows):
+	pairs = sorted(pair_rows, key=lambda pair: pair_rows[pair][0])
+	names = list(dict.fromkeys(name for code, name in pairs))
+	name_level = dict(zip(names, geo_levels(pd.Series(names, dtype=object))))
+	code_names = {}
+	name_codes = {}
+	for code, name in pairs:
+		code_names.setdefault(code, []).append(name)
+		name_codes.setdefault(name, []).append(code)
+	return {
+		'states': [name for name in names if name_level[name] == 'STATE'],
+		'name_level': name_level,
+		'name_codes': name_codes,
+		'code_names': code_names,
+		'pair_rows': pair_rows,
+	}
+
+def geo_state_codes(geo_index, state_names):
+	"""Codes of the given state names."""
+	return list(dict.fromkeys(code for name in state_names for code in geo_index['name_codes'].get(name, [])))
+
+def geo_districts(geo_index, codes):
+	"""Non-state names under the given codes, in order of their first row."""
+	firsts = {}
+	for code in codes:
+		for name in geo_index['code_names'].get(code, []):
+			if geo_index['name_level'][name] != 'STATE' and str(name).strip() != '':
+				first = geo_index['pair_rows'][(code, name)][0]
+				firsts[name] = min(first, firsts.get(name, first))
+	return sorted(firsts, key=firsts.get)
+
+def geo_rows(geo_index, codes, names, level=None):
+	"""Sorted row positions under codes whose name is in names (and at level, if given)."""
+	names = set(names)
+	parts = [
+		geo_index['pair_rows'][(code, name)]
+		for code in codes for name in geo_index['code_names'].get(code, [])
+		if name in names and (level is None or geo_index['name_level'][name] == level)
+	]
+	return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.intp)
+
+# --- Ingestion cache ---
+# Lives at module level so it survives Streamlit reruns and is shared by every session in the process.
+_fingerprint_cache = {}
+# One lock per cache key, so concurrent sessions build each value once while different keys build in parallel
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+def file_fingerprint(file_path):
+	"""Returns (name, size, mtime) identifying the current version of a file."""
+	stat = os.stat(file_path)
+	return (os.path.basename(file_path), stat.st_size, stat.st_mtime_ns)
+
+def dir_fingerprint(data_dir, ext='.csv'):
+	"""Returns the sorted fingerprints of all files in data_dir ending with ext."""
+	return tuple(sorted(
+		file_fingerprint(os.path.join(data_dir, f)) for f in os.listdir(data_dir) if f.endswith(ext)
+	))
+
+def cached_by_fingerprint(key, fingerprint, build):
+	"""
+	Returns build(), reusing the previous result stored under key while its fingerprint is unchanged.
+	Cached values are shared, callers must not modify them in place.
+	"""
+	hit = _fingerprint_cache.get(key)
+	if hit is not None and hit[0] == fingerprint:
+		count_cache(hit=True)
+		return hit[1]
+	with _key_locks_lock:
+		lock = _key_locks.setdefault(key, threading.RLock())
+	with lock:
+		# Another session may have built it while this one waited
+		hit = _fingerprint_cache.get(key)
+		if hit is not None and hit[0] == fingerprint:
+			count_cache(hit=True)
+			return hit[1]
+		count_cache(hit=False)
+		value = build()
+		_fingerprint_cache[key] = (fingerprint, value)
+		return value
+
+def replace_cached(key, replace):
+	"""Swaps the value cached under key for replace(value), an equivalent value (e.g. a view), keeping its fingerprint."""
+	hit = _fingerprint_cache.get(key)
+	if hit is not None:
+		_fingerprint_cache[key] = (hit[0], replace(hit[1]))
+
+
+# --- Encoding detection ---
+# Tried in order; latin1 maps every byte so the last attempt always succeeds.
+CSV_ENCODINGS = ['utf-8-sig', 'cp1252', 'latin1']
+# File path -> (file fingerprint, encoding that decoded that version), tried first when the same version is
+# read again. A changed file has a new fingerprint, so it is detected afresh rather than with a stale guess.
+_detected_encodings = {}
+
+def _known_encoding(file_path):
+	"""(fingerprint of file_path, encoding remembered for exactly that version or None)."""
+	fingerprint = file_fingerprint(file_path)
+	hit = _detected_encodings.get(file_path)
+	return fingerprint, hit[1] if hit is not None and hit[0] == fingerprint else None
+
+def read_text(file_path):
+	"""
+	Reads file_path once and decodes the in-memory bytes.
+	Returns (text, encoding), or (None, None) if no encoding fits.
+	"""
+	fingerprint, known = _known_encoding(file_path)
+	with open(file_path, 'rb') as f:
+		raw = f.read()
+	for enc in ([known] if known else []) + CSV_ENCODINGS:
+		try:
+			text = raw.decode(enc)
+		except UnicodeDecodeError:
+			continue
+		_detected_encodings[file_path] = (fingerprint, enc)
+		return text, enc
+	return None, None
+
+def detect_encoding(file_path, block_size=1024 ** 2):
+	"""
+	Returns the first encoding that decodes all of file_path, or None.
+	Decodes block by block, so the file is never held in memory.
+	"""
+	fingerprint, known = _known_encoding(file_path)
+	for enc in ([known] if known else []) + CSV_ENCODINGS:
+		decoder = codecs.getincrementaldecoder(enc)()
+		try:
+			with open(file_path, 'rb') as f:
+				for block in iter(lambda: f.read(block_size), b''):
+					decoder.decode(block)
+			decoder.decode(b'', final=True)
+		except UnicodeDecodeError:
+			continue
+		_detected_encodings[file_path] = (fingerprint, enc)
+		return enc
+	return None
+
+# --- CSV loading ---
+def try_read_csv(file_path):
+	"""Read a CSV file once, detecting its encoding from the raw bytes."""
+	text, enc = read_text(file_path)
+	if text is None:
+		return None
+	return pd.read_csv(io.StringIO(text))
+
+def load_csv_file(file_path):
+	"""Reads one CSV file. Returns (DataFrame, None) or (None, skip warning)."""
+	file = os.path.basename(file_path)
+	try:
+		df = try_read_csv(file_path)
+		if df is None:
+			return None, f"Skipped file due to encoding issues: {file}"
+	except pandas.errors.EmptyDataError:
+		return None, f"Skipped empty file: {file}"
+	except Exception as e:
+		return None, f"Skipped file due to error: {file} ({e})"
+	if df.empty or df.shape[1] == 0:
+		return None, f"Skipped file with no columns: {file}"
+	return df, None
+
+def load_csv_files(file_paths, workers=1, use_processes=False):
+	"""
+	Loads file_paths through the ingestion cache, parsing cache misses on a
+	thread (or process) pool of the given size.
+	Yields load_csv_file() results in the order of file_paths.
+	"""
+	return cached_map('file', load_csv_file, file_paths, workers=workers, use_processes=use_processes)
+
+def cached_map(kind, func, file_paths, workers=1, use_processes=False):
+	"""
+	Yields func(file_path) for each of file_paths in order, cached under (kind, file_path) per file fingerprint.
+	Cache misses run on a thread (or process) pool of the given size; func must be picklable for processes.
+	"""
+	fingerprints = {file_path: file_fingerprint(file_path) for file_path in file_paths}
+	pending = [
+		file_path for file_path in file_paths
+		if _fingerprint_cache.get((kind, file_path), (None,))[0] != fingerprints[file_path]
+	]
+	futures = {}
+	pool = None
+	if workers > 1 and len(pending) > 1:
+		pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+		pool = pool_cls(max_workers=min(workers, len(pending)))
+		futures = {file_path: pool.submit(func, file_path) for file_path in pending}
+	try:
+		for file_path in file_paths:
+			future = futures.get(file_path)
+			yield cached_by_fingerprint(
+				(kind, file_path), fingerprints[file_path],
+				future.result if future else lambda: func(file_path)
+			)
+	finally:
+		if pool is not None:
+			pool.shutdown(cancel_futures=True)
+
+def prune_cache(kind, file_paths):
+	"""Drops the cached (kind, file_path) entries of files that are no longer in file_paths."""
+	keep = set(file_paths)
+	for key in [key for key in _fingerprint_cache if key[0] == kind and len(key) == 2 and key[1] not in keep]:
+		del _fingerprint_cache[key]
+
+# --- Streaming ingestion ---
+# Rows parsed per chunk in streaming mode
+CSV_CHUNK_ROWS = 100000
+
+def iter_csv_chunks(file_path, chunk_rows=CSV_CHUNK_ROWS):
+	"""
+	Streams one CSV file in chunks of chunk_rows rows.
+	Yields (DataFrame, None) per chunk, or (None, skip warning) like load_csv_file.
+	A file that fails part-way keeps the chunks already yielded.
+	"""
+	file = os.path.basename(file_path)
+	try:
+		enc = detect_encoding(file_path)
+		if enc is None:
+			yield None, f"Skipped file due to encoding issues: {file}"
+			return
+		reader = pd.read_csv(file_path, encoding=enc, chunksize=chunk_rows)
+		with reader:
+			rows = 0
+			for chunk in reader:
+				if chunk.shape[1] == 0:
+					break
+				if chunk.empty:
+					continue
+				rows += len(chunk)
+				yield chunk, None
+			# Same warning as load_csv_file for a file with no columns or only a header
+			if rows == 0:
+				yield None, f"Skipped file with no columns: {file}"
+	except pandas.errors.EmptyDataError:
+		yield None, f"Skipped empty file: {file}"
+	except Exception as e:
+		yield None, f"Skipped file due to error: {file} ({e})"
+
+# --- Columnar snapshot ---
+# Bump when the cleaning steps change so existing snapshots are rebuilt.
+SNAPSHOT_SCHEMA_VERSION = 5
+
+def snapshot_manifest(file_paths):
+	"""Describes the source CSVs a snapshot is built from."""
+	return {
+		'schema_version': SNAPSHOT_SCHEMA_VERSION,
+		'files': [list(file_fingerprint(file_path)) for file_path in sorted(file_paths)],
+	}
+
+# Schema metadata marking snapshots written chunk by chunk (see write_snapshot_chunks)
+CHUNKED_SNAPSHOT_KEY = b'ihrgv.chunked'
+
+def read_snapshot(snapshot_path, manifest, restore=None):
+	"""
+	Memory-maps the Feather snapshot at snapshot_path.
+	restore(df) is applied to snapshots written by write_snapshot_chunks, to bring back the dtypes they store plainly.
+	Returns None if pyarrow is missing, the snapshot does not exist or its manifest is stale.
+	"""
+	if feather is None:
+		return None
+	try:
+		with open(snapshot_path + '.manifest.json', encoding='utf-8') as f:
+			if json.load(f) != manifest:
+				return None
+		table = feather.read_table(snapshot_path, memory_map=True)
+		df = table.to_pandas()
+		if restore is not None and CHUNKED_SNAPSHOT_KEY in (table.schema.metadata or {}):
+			df = restore(df)
+		return df
+	except (OSError, ValueError):
+		return None
+
+def write_snapshot(df, snapshot_path, manifest):
+	"""
+	Writes df as an uncompressed Feather file (so it can be memory-mapped) followed by its manifest.
+	Returns False if pyarrow is not installed.
+	"""
+	if feather is None:
+		return False
+	# Unique per writer, so concurrent builds of the same snapshot never share a temporary file
+	tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+	os.replace(tmp_path, snapshot_path)
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		json.dump(manifest, f)
+	os.replace(tmp_path, snapshot_path + '.manifest.json')
+	return True
+
+def _plain_table(df):
+	"""df as an Arrow table with categoricals as their values and integers as int64, so every chunk has one schema."""
+	table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+	columns = []
+	for field, column in zip(table.schema, table.columns):
+		if pa.types.is_dictionary(field.type):
+			column = column.cast(field.type.value_type)
+		elif pa.types.is_integer(field.type):
+			column = column.cast(pa.int64())
+		columns.append(column)
+	return pa.table(columns, names=table.column_names)
+
+def write_snapshot_chunks(chunks, snapshot_path, manifest):
+	"""
+	Writes an iterable of frames with the same columns as one uncompressed Feather snapshot, one record batch
+	per frame as it arrives, so only the current frame is held in memory. Every frame has its own categories
+	and integer widths, so categoricals are stored as their values and integers as int64; pass read_snapshot
+	a restore function for them. Returns the number of rows written (0 writes no snapshot),
+	or None without consuming chunks if pyarrow is not installed.
+	"""
+	if feather is None:
+		return None
+	tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	writer = None
+	rows = 0
+	try:
+		for df in chunks:
+			table = _plain_table(df)
+			if writer is None:
+				schema = table.schema.with_metadata({CHUNKED_SNAPSHOT_KEY: b'1'})
+				writer = pa.ipc.new_file(tmp_path, schema)
+			writer.write_table(table.cast(schema))
+			rows += len(df)
+		if rows:
+			writer.close()
+			writer = None
+			os.replace(tmp_path, snapshot_path)
+			with open(tmp_path, 'w', encoding='utf-8') as f:
+				json.dump(manifest, f)
+			os.replace(tmp_path, snapshot_path + '.manifest.json')
+	finally:
+		if writer is not None:
+			writer.close()
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+	return rows